@@ -1,13 +1,19 @@
 import time
 
 import os
+import sys
 import argparse
 
 import appdirs
 import platform
 
-from stm.gt7 import GT7Logger, GT7Sampler
+from stm.gt7.sampler import DEFAULT_PORT
+from stm.gt7 import GT7Logger, GT7Sampler, GT7AsyncSampler, GT7MultiSampler, GT7ProcessSampler
 from stm.sampler import RawSampler
+from stm.samplequeue import POLICIES, DROP_OLDEST, BLOCK
+from stm.rawfile import CODECS
+from stm.gt7.convert import find_rawfiles, convert_many
+from stm.checkpoint import find_checkpoints, recover as recover_checkpoint
 
 from logging import getLogger, basicConfig, DEBUG
 basicConfig(
@@ -18,12 +24,99 @@ basicConfig(
 l = getLogger(__name__)
 
 
+def logs_dirs():
+    if platform.system() == "Windows":
+        logs_dir = os.path.join("logs", "gt7")
+        logs_raw = os.path.join("logs", "raw")
+    else:
+        config_dir = appdirs.user_config_dir(appname="LaudaGT")
+        os.makedirs(config_dir, exist_ok=True)
+        logs_dir = config_dir
+        logs_raw = config_dir
+    return logs_dir, logs_raw
+
+
+def convert():
+
+    parser = argparse.ArgumentParser(
+        prog="gt7-cli.py convert",
+        description="Converter arquivos RAW do GT7 para o MoTeC i2 em paralelo")
+    parser.add_argument("rawfiles", nargs="+",
+                        help="Arquivos RAW, diretórios ou padrões como logs/raw/*.db")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Diretório dos arquivos .ld/.ldx")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Número de arquivos convertidos em paralelo, por padrão um por CPU")
+    parser.add_argument("--force", action="store_true",
+                        help="Converter também os arquivos já convertidos")
+    parser.add_argument("--driver", type=str, default="",
+                        help="Nome do piloto")
+    parser.add_argument("--session", type=str, default="",
+                        help="Sessão (Treino, Classificação, Corrida)")
+    parser.add_argument("--vehicle", type=str, default="",
+                        help="Substituir o nome do carro")
+    parser.add_argument("--venue", type=str, default="",
+                        help="Nome da pista, o MoTeC não gerará o mapa sem o nome")
+    parser.add_argument("--replay", action="store_true",
+                        help="Gravar dados do replay")
+    args = parser.parse_args(sys.argv[2:])
+
+    rawfiles = find_rawfiles(args.rawfiles)
+    if not rawfiles:
+        parser.error("nenhum arquivo RAW encontrado")
+
+    convert_many(
+        rawfiles,
+        args.output or logs_dirs()[0],
+        workers=args.jobs,
+        force=args.force,
+        replay=args.replay,
+        driver=args.driver,
+        session=args.session,
+        vehicle=args.vehicle,
+        venue=args.venue
+    )
+
+
+def recover():
+
+    parser = argparse.ArgumentParser(
+        prog="gt7-cli.py recover",
+        description="Recuperar os logs dos checkpoints deixados por uma captura interrompida")
+    parser.add_argument("dirs", nargs="*",
+                        help="Diretórios com os checkpoints, por padrão o diretório dos logs")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Diretório dos arquivos .ld/.ldx, por padrão o do log original")
+    args = parser.parse_args(sys.argv[2:])
+
+    checkpoints = find_checkpoints(args.dirs or [logs_dirs()[0]])
+    if not checkpoints:
+        l.info("Nenhum checkpoint encontrado")
+
+    for checkpoint in checkpoints:
+        try:
+            filename = recover_checkpoint(checkpoint, outdir=args.output)
+        except Exception as e:
+            l.error(f"Erro recuperando {checkpoint}: {e}")
+            continue
+        l.info(f"Recuperado {filename}")
+
+
 def main():
 
+    if len(sys.argv) > 1 and sys.argv[1] == "convert":
+        convert()
+        return
+
+    if len(sys.argv) > 1 and sys.argv[1] == "recover":
+        recover()
+        return
+
     parser = argparse.ArgumentParser(
         description="Converter os pacotes do GT7 para o MoTeC i2")
     parser.add_argument(
-        "addr", type=str, help="Endereço IP do PlayStation ou arquivo RAW")
+        "addr", type=str, nargs="+",
+        help="Endereço IP do PlayStation ou arquivo RAW, vários endereços para capturar vários PlayStations")
     parser.add_argument("--driver", type=str, default="",
                         help="Nome do piloto")
     parser.add_argument("--session", type=str, default="",
@@ -39,50 +132,117 @@ def main():
     parser.add_argument(
         "--saveraw", help="Salvar os pacotes em um banco SQLite3 (RAW)", action="store_true")
     parser.add_argument(
-        "--loadraw", help="Carregar os pacotes de um banco SQLite3 (RAW)", action="store_true")
+        "--loadraw", help="Carregar os pacotes de um banco SQLite3 ou arquivo .raw (RAW)", action="store_true")
+    parser.add_argument("--speed", default="max",
+                        help="Velocidade do --loadraw: max, ou 1.0 para tempo real, 2.0 para o dobro ...")
+    parser.add_argument("--batch", action="store_true",
+                        help="Calcular os canais do --loadraw em blocos de pacotes com NumPy")
+    parser.add_argument("--rawformat", choices=("db", "raw", "rawz"), default="db",
+                        help="Formato do RAW salvo, banco SQLite3, arquivo .raw com índice de ticks"
+                        " ou arquivo .rawz descriptografado e comprimido")
+    parser.add_argument("--rawcodec", choices=tuple(CODECS), default="zlib",
+                        help="Compressão do arquivo .rawz")
+    parser.add_argument("--slots", type=int, default=0,
+                        help="Receber os pacotes em um buffer circular com N posições")
+    parser.add_argument("--queue", type=int, default=0,
+                        help="Número máximo de pacotes na fila, 0 sem limite")
+    parser.add_argument("--policy", choices=POLICIES, default=DROP_OLDEST,
+                        help="O que fazer com a fila cheia")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="Receber os pacotes com asyncio")
+    parser.add_argument("--process", action="store_true",
+                        help="Receber os pacotes em um processo separado, usando --slots posições de memória compartilhada")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Descriptografar os pacotes em N processos")
+    parser.add_argument("--spill", action="store_true",
+                        help="Manter só o último minuto das amostras em memória, o resto em arquivos temporários no diretório dos logs")
+    parser.add_argument("--checkpoint", type=int, default=0,
+                        help="Salvar um checkpoint do log a cada N segundos, recuperável com o comando recover")
+    parser.add_argument("--ports", type=int, nargs="+",
+                        help="Uma porta UDP por PlayStation em vez de uma porta compartilhada")
     args = parser.parse_args()
 
-    if platform.system() == "Windows":
-        logs_dir = os.path.join("logs", "gt7")
-        logs_raw = os.path.join("logs", "raw")
-    else:
-        config_dir = appdirs.user_config_dir(appname="LaudaGT")
-        os.makedirs(config_dir, exist_ok=True)
-        logs_dir = config_dir
-        logs_raw = config_dir
+    logs_dir, logs_raw = logs_dirs()
 
     filetemplate = os.path.join(
         logs_dir, "{driver}_{venue}_{session}_{datetime}")
 
-    if args.saveraw:
-        rawfile = os.path.join(logs_raw, f"{time.time():.0f}.db")
-    else:
-        rawfile = None
+    started = time.time()
+
+    if args.ports and len(args.ports) != len(args.addr):
+        parser.error("informe uma porta para cada PlayStation")
+
+    if args.policy == BLOCK and len(args.addr) > 1 and not args.loadraw:
+        parser.error(f"a política {BLOCK} não pode ser usada com mais de um PlayStation")
+
+    if len(args.addr) > 1 and not args.loadraw:
+        # the consoles share the receive thread of GT7MultiSampler
+        for option, used in (("--process", args.process), ("--slots", args.slots), ("--asyncio", args.asyncio)):
+            if used:
+                parser.error(f"{option} não pode ser usado com mais de um PlayStation")
+
+    if args.policy == BLOCK and args.asyncio and not args.loadraw:
+        parser.error(f"a política {BLOCK} não pode ser usada com --asyncio")
 
     if args.loadraw:
-        sampler = RawSampler(rawfile=args.addr)
+        names = [os.path.splitext(os.path.basename(rawfile))[0] if len(args.addr) > 1 else None
+                 for rawfile in args.addr]
+        samplers = [(name, RawSampler(rawfile=rawfile, speed=args.speed)) for name, rawfile in zip(names, args.addr)]
+    elif len(args.addr) > 1:
+        # one receive thread for all the consoles, one logger per console
+        multi = GT7MultiSampler(addrs=args.addr, freq=args.freq, ports=args.ports,
+                                maxsize=args.queue, policy=args.policy)
+        samplers = list(multi.sources.items())
+    elif args.process:
+        port = args.ports[0] if args.ports else DEFAULT_PORT
+        samplers = [(None, GT7ProcessSampler(addr=args.addr[0], port=port, freq=args.freq,
+                                             slots=args.slots))]
+    elif args.asyncio:
+        samplers = [(None, GT7AsyncSampler(addr=args.addr[0], freq=args.freq,
+                                           maxsize=args.queue, policy=args.policy))]
     else:
-        sampler = GT7Sampler(addr=args.addr, freq=args.freq)
+        port = args.ports[0] if args.ports else DEFAULT_PORT
+        samplers = [(None, GT7Sampler(addr=args.addr[0], port=port, freq=args.freq, slots=args.slots,
+                                      maxsize=args.queue, policy=args.policy))]
 
-    logger = GT7Logger(
-        rawfile=rawfile,
-        sampler=sampler,
-        filetemplate=filetemplate,
-        replay=args.replay,
-        driver=args.driver,
-        session=args.session,
-        vehicle=args.vehicle,
-        venue=args.venue
-    )
+    loggers = []
+    for addr, sampler in samplers:
+        # keep the files of each console apart
+        suffix = f"_{addr}" if addr else ""
+
+        if args.saveraw:
+            rawfile = os.path.join(logs_raw, f"{started:.0f}{suffix}.{args.rawformat}")
+        else:
+            rawfile = None
+
+        loggers.append(GT7Logger(
+            rawfile=rawfile,
+            sampler=sampler,
+            filetemplate=filetemplate + suffix,
+            replay=args.replay,
+            driver=args.driver,
+            session=args.session,
+            vehicle=args.vehicle,
+            venue=args.venue,
+            workers=args.workers,
+            rawcodec=args.rawcodec,
+            batch=args.batch and args.loadraw,
+            spill=logs_dir if args.spill or args.checkpoint else None,
+            checkpoint=args.checkpoint
+        ))
 
     try:
-        logger.start()
-        while logger.is_alive():
-            logger.join(0.1)
+        for logger in loggers:
+            logger.start()
+        while any(logger.is_alive() for logger in loggers):
+            for logger in loggers:
+                logger.join(0.1)
     except KeyboardInterrupt:
         l.warning("Finalizando")
-        logger.stop()
-        logger.join()
+        for logger in loggers:
+            logger.stop()
+        for logger in loggers:
+            logger.join()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+from .motec import MotecLog, MotecLogExtra, MotecEvent
+import glob
+import json
+import os
+from logging import getLogger
+l = getLogger(__name__)
+
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def header_state(obj):
+    # the header fields that have been set
+    state = vars(obj)
+    return {key: state[key] for _, key in obj.header.fields if key and key in state}
+
+
+def save_checkpoint(log, logx, filename):
+    """
+    checkpoint a spilling log into its spill directory
+
+    The samples are only appended to the spill files, the checkpoint file
+    just records the headers, the laps and how many samples of every
+    channel are complete, so it stays small however long the log gets.
+    """
+    log.flush()
+
+    numsamples = None
+    for channel in log.channels:
+        samples = channel.samples
+        samples.spillfile.flush()
+        os.fsync(samples.spillfile.fileno())
+        numsamples = samples.spilled if numsamples is None else min(numsamples, samples.spilled)
+
+    state = {
+        "filename": filename,
+        "log": header_state(log),
+        "event": header_state(log.event) if getattr(log, "event", None) else None,
+        "channels": [header_state(channel) for channel in log.channels],
+        "numsamples": numsamples or 0,
+        "laps": logx.laps,
+    }
+
+    # replace the last checkpoint in one go
+    checkpoint = os.path.join(log.spilldir, CHECKPOINT_FILE)
+    with open(checkpoint + ".tmp", "w") as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(checkpoint + ".tmp", checkpoint)
+
+
+def load_checkpoint(directory):
+    """
+    rebuild the log, its laps and filename from a checkpoint directory, the
+    samples written after the last checkpoint are dropped
+    """
+    with open(os.path.join(directory, CHECKPOINT_FILE)) as f:
+        state = json.load(f)
+
+    log = MotecLog(state["log"])
+    if state["event"]:
+        log.event = MotecEvent(state["event"])
+
+    numsamples = state["numsamples"]
+    for idx, channel in enumerate(state["channels"]):
+        log.add_channel(channel)
+        samples = log.channels[idx].samples
+        samples.spill(os.path.join(directory, f"{idx}.spill"), append=True)
+        samples.spillfile.truncate(numsamples * samples.datasize)
+        samples.spilled = numsamples
+
+    log.spilldir = directory
+
+    logx = MotecLogExtra()
+    logx.laps = state["laps"]
+
+    return log, logx, state["filename"]
+
+
+def find_checkpoints(directories):
+    """
+    the checkpoint directories left behind in the directories
+    """
+    checkpoints = []
+    for directory in directories:
+        pattern = os.path.join(glob.escape(directory), "*", CHECKPOINT_FILE)
+        checkpoints.extend(sorted(os.path.dirname(c) for c in glob.glob(pattern)))
+    return checkpoints
+
+
+def recover(directory, outdir=None):
+    """
+    write the .ld/.ldx of a checkpoint and remove it, returns the filename
+    """
+    log, logx, filename = load_checkpoint(directory)
+    if outdir:
+        filename = os.path.join(outdir, os.path.basename(filename))
+
+    if not logx.valid_laps():
+        l.warning(f"O log {filename} tem menos de 2 voltas")
+
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+
+    ldxfilename = f"{filename}.ldx"
+    l.info(f"Salvando as voltas em {ldxfilename}")
+    with open(ldxfilename, "w") as fout:
+        logx.write(fout)
+
+    ldfilename = f"{filename}.ld"
+    l.info(f"Salvando o log MoTeC em {ldfilename}, {log.channels[0].samples.numsamples if log.channels else 0} amostras")
+    with open(ldfilename, "wb") as fout:
+        log.write(fout)
+
+    # drops the checkpoint
+    log.close()
+    return filename
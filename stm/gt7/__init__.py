@@ -1,3 +1,6 @@
 from .packet import GT7DataPacket
 from .sampler import GT7Sampler
-from .logger import GT7Logger
\ No newline at end of file
+from .aiosampler import GT7AsyncSampler
+from .logger import GT7Logger
+from .multisampler import GT7MultiSampler
+from .procsampler import GT7ProcessSampler
\ No newline at end of file
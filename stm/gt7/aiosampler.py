@@ -0,0 +1,118 @@
+from stm.sampler import BaseSampler
+from stm.samplequeue import DROP_OLDEST, BLOCK
+from .sampler import DEFAULT_PORT, DEFAULT_HEARTBEAT_PORT
+import asyncio
+import socket
+import time
+from logging import getLogger
+l = getLogger(__name__)
+
+# GT7 stops sending after ~100 packets without a heartbeat
+HEARTBEAT_PACKETS = 100
+
+
+class GT7Protocol(asyncio.DatagramProtocol):
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def datagram_received(self, data, addr):
+        self.sampler.receive(time.time(), data)
+
+    def error_received(self, exc):
+        # e.g. the heartbeat bouncing off a console that is switched off
+        pass
+
+
+class GT7AsyncSampler(BaseSampler):
+
+    """
+    asyncio version of the GT7Sampler
+
+    Either await serve() from an existing event loop, next to anything else
+    running in it, or start() it like any other sampler to get its own
+    thread and loop. Heartbeats are sent on a timer every HEARTBEAT_PACKETS
+    samples worth of time instead of being counted off the packets. The
+    packets are queued from the event loop, so a full queue can't block.
+    """
+
+    def __init__(self, addr=None, port=DEFAULT_PORT, hb_port=DEFAULT_HEARTBEAT_PORT, freq=None,
+                 maxsize=0, policy=DROP_OLDEST):
+        if policy == BLOCK:
+            raise ValueError(f"the {BLOCK} policy would block the event loop")
+
+        super().__init__(freq=freq, maxsize=maxsize, policy=policy)
+        self.port = int(port)
+        if self.port != DEFAULT_PORT:
+            # do not send heartbeats if we are not running on the default ports
+            # as GT7 will ignore them anyway
+            self.hb_addr = None
+            l.info("Redirecionando os pacotes UDP.")
+        else:
+            self.hb_addr = (addr, hb_port)
+
+        self.hb_interval = HEARTBEAT_PACKETS / (freq or 60)
+        self.listeners = []
+        self.transport = None
+        self.loop = None
+        self.stopped = None
+
+    def add_listener(self, listener):
+        """
+        call listener(timestamp, data) from the event loop for every packet,
+        e.g. to fan the live packets out to other consumers
+        """
+        self.listeners.append(listener)
+
+    def receive(self, timestamp, data):
+        self.put((timestamp, data))
+        for listener in self.listeners:
+            listener(timestamp, data)
+
+    async def serve(self):
+
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+
+        # Create a UDP socket for the inbound packets
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # Set the SO_REUSEADDR option to allow immediate reuse of the port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        # Bind to any address
+        sock.bind(('0.0.0.0', self.port))
+
+        self.transport, _ = await self.loop.create_datagram_endpoint(
+            lambda: GT7Protocol(self), sock=sock)
+
+        self.running = True  # this is set to False in BaseSampler when we are done
+        try:
+            while self.running:
+                self.send_hb()
+                try:
+                    await asyncio.wait_for(self.stopped.wait(), self.hb_interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.transport.close()
+            self.transport = None
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    def stop(self):
+        super().stop()
+        if self.loop and self.stopped:
+            self.loop.call_soon_threadsafe(self.stopped.set)
+
+    def send_hb(self):
+        if not self.hb_addr or not self.transport:
+            return
+
+        send_data = b'A'
+        try:
+            self.transport.sendto(send_data, self.hb_addr)
+        except Exception:
+            # sent again on the next timer
+            pass
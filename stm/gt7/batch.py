@@ -0,0 +1,127 @@
+import numpy as np
+
+import stm.gps as gps
+from stm.maths import Vector, Quaternion
+from .columns import decode_columns
+
+MS_TO_MPH = 2.23693629
+MS_TO_KPH = 3.6
+
+
+class PacketRow():
+
+    """
+    the fields of one row of a block of decoded columns that GT7Logger
+    needs to sequence the packets, standing in for a GT7DataPacket
+
+    row is the index of the packet in the block, the channels themselves are
+    only computed for the whole block by compute_channels
+    """
+
+    __slots__ = ("row", "tick", "paused", "in_race", "current_lap", "laps",
+                 "last_laptime", "car_code", "position")
+
+    def __init__(self, row, tick, paused, in_race, current_lap, laps, last_laptime, car_code, position):
+        self.row = row
+        self.tick = tick
+        self.paused = paused
+        self.in_race = in_race
+        self.current_lap = current_lap
+        self.laps = laps
+        self.last_laptime = last_laptime
+        self.car_code = car_code
+        self.position = position
+
+
+def packet_rows(columns):
+    """
+    one PacketRow per packet of a block of decoded columns
+    """
+    positions = [Vector(x, y, z) for x, y, z in columns["position"].astype(np.float64).tolist()]
+    return [PacketRow(*fields) for fields in zip(
+        range(len(positions)),
+        columns["tick"].tolist(),
+        columns["paused"].tolist(),
+        columns["in_race"].tolist(),
+        columns["current_lap"].tolist(),
+        columns["laps"].tolist(),
+        columns["last_laptime"].tolist(),
+        columns["car_code"].tolist(),
+        positions
+    )]
+
+
+def decode_block(ddata):
+    """
+    decode a (N, size) block of decrypted packets into columns and rows
+    """
+    columns = decode_columns(ddata)
+    return columns, packet_rows(columns)
+
+
+def compute_channels(columns, cur, prev, beacon, freq):
+    """
+    compute the samples of every GT7Logger channel for the packets at the
+    indexes cur of the block of columns, prev being the index of the packet
+    before each one and beacon the beacon of each one
+
+    Does the same float64 operations in the same order as
+    GT7Logger.packet_samples, so the samples are the same as the ones of
+    the streaming path. Returns one array per channel.
+    """
+    cur = np.asarray(cur, dtype=np.intp)
+    prev = np.asarray(prev, dtype=np.intp)
+
+    def column(name, idx=cur):
+        values = columns[name][idx]
+        if values.dtype.kind == "f":
+            values = values.astype(np.float64)
+        return values
+
+    position = column("position")
+    lat, long = gps.convert(x=position[:, 0], z=-position[:, 2])
+
+    # mult the world deltav with the rotation to get local deltav
+    velocity = column("velocity")
+    last_velocity = column("velocity", prev)
+    deltav = (Vector(*velocity.T) - Vector(*last_velocity.T)) * Quaternion(*column("rotation").T)
+
+    glat = deltav.x * freq / 9.8  # X
+    gvert = deltav.y * freq / 9.8  # Y
+    glong = deltav.z * freq / 9.8  # Z
+
+    # wheelspeed is only inverted in race
+    wheelspeed = column("wheelradius") * column("wheelspeed")
+    wheelspeed = np.where(column("in_race")[:, None], wheelspeed * -MS_TO_MPH, wheelspeed * MS_TO_MPH)
+
+    speed = column("speed")
+    suspension = column("suspension") * 100
+    tyretemp = column("tyretemp")
+
+    return [
+        np.asarray(beacon, dtype=np.int64),
+        column("current_lap"),
+        column("rpm"),
+        column("gear"),
+        column("throttle").astype(np.int64) * 100 / 255,
+        column("brake").astype(np.int64) * 100 / 255,
+        speed * MS_TO_MPH,
+        lat,
+        long,
+        deltav.x,
+        deltav.y,
+        -deltav.z,
+        glat,
+        gvert,
+        -glong,
+        *suspension.T,
+        *wheelspeed.T,
+        *tyretemp.T,
+        column("ride_height") * 100,
+        speed * MS_TO_KPH,
+        column("current_fuel"),
+        column("turbo_boost"),
+        column("oil_pressure"),
+        column("asm"),
+        column("tcs"),
+    ]
@@ -0,0 +1,81 @@
+import numpy as np
+
+from .packet import GT7DataPacket, Flags
+
+# NumPy view of a decrypted packet, same offsets as GT7DataPacket.fmt and
+# named after the attributes the unpacked values end up in
+#   name, dtype, offset
+FIELDS = [
+    ("magic",         "<u4",      0x0000),
+    ("position",      ("<f4", 3), 0x0004),
+    ("velocity",      ("<f4", 3), 0x0010),
+    ("rotation",      ("<f4", 4), 0x001C),  # w, x, y, z
+    ("ride_height",   "<f4",      0x0038),
+    ("rpm",           "<f4",      0x003C),
+    ("current_fuel",  "<f4",      0x0044),
+    ("speed",         "<f4",      0x004C),
+    ("turbo_boost",   "<f4",      0x0050),
+    ("oil_pressure",  "<f4",      0x0054),
+    ("tyretemp",      ("<f4", 4), 0x0060),  # fl, fr, rl, rr
+    ("tick",          "<i4",      0x0070),
+    ("current_lap",   "<i2",      0x0074),
+    ("laps",          "<i2",      0x0076),
+    ("best_laptime",  "<i4",      0x0078),
+    ("last_laptime",  "<i4",      0x007C),
+    ("race_position", "<i2",      0x0084),
+    ("rev_upshift",   "<i2",      0x0086),
+    ("rev_limit",     "<i2",      0x0088),
+    ("opponents",     "<i2",      0x008A),
+    ("flags",         "<u2",      0x008E),
+    ("gears",         "u1",       0x0090),  # suggested:current nibbles
+    ("throttle",      "u1",       0x0091),
+    ("brake",         "u1",       0x0092),
+    ("wheelspeed",    ("<f4", 4), 0x00A4),
+    ("wheelradius",   ("<f4", 4), 0x00B4),
+    ("suspension",    ("<f4", 4), 0x00C4),
+    ("car_code",      "<u4",      0x0124),
+]
+
+PACKET_DTYPE = np.dtype({
+    "names": [f[0] for f in FIELDS],
+    "formats": [f[1] for f in FIELDS],
+    "offsets": [f[2] for f in FIELDS],
+    "itemsize": GT7DataPacket.size,
+})
+
+
+def to_records(ddata):
+    """
+    map a block of decrypted packets, either a (N, size) uint8 array such as
+    the one returned by GT7DataPacket.decrypt_many or a bytes like object of
+    N * size bytes, onto a structured array without copying
+    """
+    if isinstance(ddata, np.ndarray):
+        ddata = np.ascontiguousarray(ddata, dtype=np.uint8)
+        return ddata.reshape(-1).view(PACKET_DTYPE)
+    return np.frombuffer(ddata, dtype=PACKET_DTYPE)
+
+
+def decode_columns(ddata, valid=None):
+    """
+    decode a block of decrypted packets into a dict of one array per field,
+    with the gear nibbles and the flag bits split out into their own columns
+    like the attributes of GT7DataPacket
+    """
+    records = to_records(ddata)
+    if valid is not None:
+        records = records[valid]
+
+    columns = {name: records[name] for name in PACKET_DTYPE.names}
+
+    gears = columns["gears"]
+    columns["gear"] = gears & 0x0F
+    columns["suggested_gear"] = (gears & 0xF0) >> 4
+
+    flags = columns["flags"]
+    columns["paused"] = (flags & Flags.PAUSED.value) != 0
+    columns["in_race"] = (flags & Flags.IN_RACE.value) != 0
+    columns["asm"] = (flags & Flags.ASM.value) != 0
+    columns["tcs"] = (flags & Flags.TCS.value) != 0
+
+    return columns
@@ -0,0 +1,122 @@
+from stm.sampler import RawSampler
+from stm.rawfile import RAW_EXTENSION, CHUNKED_EXTENSION
+from .logger import GT7Logger
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import glob
+import json
+import os
+import time
+from logging import getLogger
+l = getLogger(__name__)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RAW_EXTENSIONS = (".db", RAW_EXTENSION, CHUNKED_EXTENSION)
+
+# written next to the logs once a capture has been converted
+CONVERTED_EXTENSION = ".converted"
+
+
+def find_rawfiles(paths):
+    """
+    expand the directories and globs into the list of raw captures to convert
+    """
+    rawfiles = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            matches = glob.glob(path)
+        rawfiles.extend(sorted(m for m in matches
+                               if os.path.isfile(m) and m.endswith(RAW_EXTENSIONS)))
+    return rawfiles
+
+
+def output_template(rawfile, outdir):
+    # every log converted from the capture starts with the name of the
+    # capture, extension included, as x.db and its x.rawz copy may be
+    # converted side by side
+    return os.path.join(outdir, os.path.basename(rawfile) + "_{venue}_{session}_{datetime}")
+
+
+def converted_record(rawfile, outdir):
+    # the log names can't tell captures apart, e.g. 1700000000 and
+    # 1700000000_192.168.0.10, so the capture is recorded by its own name
+    return os.path.join(outdir, os.path.basename(rawfile) + CONVERTED_EXTENSION)
+
+
+def capture_state(rawfile):
+    stat = os.stat(rawfile)
+    return {"rawfile": os.path.basename(rawfile), "mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def is_converted(rawfile, outdir):
+    """
+    the capture was converted into outdir and has not changed since
+    """
+    try:
+        with open(converted_record(rawfile, outdir)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return state == capture_state(rawfile)
+
+
+def convert_file(rawfile, outdir, **kwargs):
+    """
+    replay one capture through a GT7Logger, returns the number of packets
+    """
+    # the channels of each batch of packets are computed with numpy if we can
+    kwargs.setdefault("batch", numpy is not None)
+    logger = GT7Logger(
+        sampler=RawSampler(rawfile=rawfile),
+        filetemplate=output_template(rawfile, outdir),
+        **kwargs
+    )
+    logger.start()
+    logger.join()
+    if logger.error:
+        raise logger.error
+
+    os.makedirs(outdir, exist_ok=True)
+    with open(converted_record(rawfile, outdir), "w") as f:
+        json.dump(capture_state(rawfile), f)
+    return logger.packets
+
+
+def convert_many(rawfiles, outdir, workers=None, force=False, **kwargs):
+    """
+    convert the captures in parallel on a process pool, skipping the ones
+    that are already converted, returns the number of packets converted
+    """
+    if not force:
+        skipped = [rawfile for rawfile in rawfiles if is_converted(rawfile, outdir)]
+        for rawfile in skipped:
+            l.info(f"Ignorando {rawfile}, já convertido")
+        rawfiles = [rawfile for rawfile in rawfiles if rawfile not in skipped]
+
+    started = time.monotonic()
+    packets = 0
+    converted = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_file, rawfile, outdir, **kwargs): rawfile
+                   for rawfile in rawfiles}
+        for future in as_completed(futures):
+            rawfile = futures[future]
+            try:
+                count = future.result()
+            except Exception as e:
+                l.error(f"Erro convertendo {rawfile}: {e}")
+                continue
+            l.info(f"Convertido {rawfile}: {count} pacotes")
+            packets += count
+            converted += 1
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    l.info(f"Convertidos {converted} arquivos, {packets} pacotes em {elapsed:.1f}s:"
+           f" {packets / elapsed:.0f} pacotes/s, {converted / elapsed:.2f} arquivos/s")
+    return packets
@@ -3,12 +3,24 @@ from stm.event import STMEvent
 import stm.gps as gps
 from datetime import datetime
 from copy import copy
-from .packet import GT7DataPacket
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .packet import GT7DataPacket, STAGED_DECRYPT, packet_tick, decrypt_packets
 from .db.cars import lookup_car_name
 from .db.tracks import GT7TrackDetector
+import struct
+
+try:
+    import numpy as np
+    from .batch import decode_block, compute_channels
+except ImportError:
+    np = None
 from logging import getLogger
 l = getLogger(__name__)
 
+# packets per task of the decrypt pool
+CHUNKSIZE = 64
+
 
 class GT7Logger(BaseLogger):
 
@@ -24,6 +36,9 @@ class GT7Logger(BaseLogger):
                 'kph', 'fuelrem', 'turbopres', 'oilpres', 'asm', 'tcs'
                 ]
 
+    sample_tick = staticmethod(packet_tick)
+    sample_decrypt = staticmethod(decrypt_packets)
+
     def __init__(self,
                  rawfile=None,
                  sampler=None,
@@ -35,8 +50,15 @@ class GT7Logger(BaseLogger):
                  driver="",
                  venue="",
                  comment="",
-                 shortcomment=""):
-        super().__init__(rawfile=rawfile, sampler=sampler, filetemplate=filetemplate)
+                 shortcomment="",
+                 staged=None,
+                 workers=0,
+                 rawcodec="zlib",
+                 batch=False,
+                 spill=None,
+                 checkpoint=None):
+        super().__init__(rawfile=rawfile, sampler=sampler, filetemplate=filetemplate, rawcodec=rawcodec,
+                         spill=spill, checkpoint=checkpoint)
 
         self.event = STMEvent(
             name=name,
@@ -56,9 +78,119 @@ class GT7Logger(BaseLogger):
         self.track_detector = None
         self.replay = replay
 
+        # only decrypt what is needed to drop paused/menu packets
+        self.staged = STAGED_DECRYPT if staged is None else staged
+        self.packets = 0
+        self.rejected_packets = 0
+
+        # decrypt on a pool of processes, everything else stays in order here
+        self.workers = workers
+        self.executor = None
+        self.pending = deque()
+
+        # compute the channels of each batch of samples with numpy
+        if batch and np is None:
+            raise ImportError("numpy is required to convert the samples in batches")
+        self.batch = batch
+        self.block = None
+        self.block_rows = []
+        self.last_ddata = None
+
+    def run(self):
+        try:
+            super().run()
+        finally:
+            if self.executor:
+                self.executor.shutdown(cancel_futures=True)
+                self.executor = None
+
+    def process_samples(self, samples):
+        if self.batch:
+            self.process_block(samples)
+            return
+
+        if not self.workers or not getattr(self.sampler, "encrypted", True):
+            super().process_samples(samples)
+            return
+
+        if not self.executor:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+
+        for i in range(0, len(samples), CHUNKSIZE):
+            chunk = samples[i:i + CHUNKSIZE]
+            # the samples may be views of the sampler buffers, which can't be pickled
+            future = self.executor.submit(decrypt_packets, [bytes(sample) for _, sample in chunk])
+            self.pending.append(([timestamp for timestamp, _ in chunk], future))
+
+        # keep the pool busy but take the finished chunks in order
+        while self.pending and (len(self.pending) > 2 * self.workers or self.pending[0][1].done()):
+            self.process_chunk(*self.pending.popleft())
+
+    def flush_samples(self):
+        while self.pending:
+            self.process_chunk(*self.pending.popleft())
+
+    def process_chunk(self, timestamps, future):
+        for timestamp, ddata in zip(timestamps, future.result()):
+            self.process_decrypted(timestamp, GT7DataPacket(ddata, encrypted=False))
+
+    def process_block(self, samples):
+        packets = [bytes(sample) for _, sample in samples]
+        if getattr(self.sampler, "encrypted", True):
+            valid, ddata = GT7DataPacket.decrypt_many(packets)
+        else:
+            # e.g. replaying a compressed capture
+            ddata = np.frombuffer(b"".join(packets), dtype=np.uint8).reshape(len(packets), -1)
+            valid = None
+
+        # the last packet of the previous block goes first, the first packet
+        # of this block is compared against it
+        offset = 0
+        if self.last_packet:
+            ddata = np.concatenate([self.last_ddata[None, :], ddata])
+            offset = 1
+
+        columns, rows = decode_block(ddata)
+        if valid is None:
+            valid = columns["magic"][offset:] == GT7DataPacket.magic
+
+        self.block = columns
+        if offset:
+            self.last_packet = rows[0]
+
+        try:
+            for (timestamp, _), ok, p in zip(samples, valid, rows[offset:]):
+                if not ok:
+                    raise struct.error("invalid magic number")
+                self.process_decrypted(timestamp, p)
+        finally:
+            self.flush_block()
+            if self.last_packet:
+                self.last_ddata = ddata[self.last_packet.row].copy()
+
+    def flush_block(self):
+        """
+        add the samples of the packets of the block accepted so far to the log
+        """
+        if not self.block_rows:
+            return
+
+        cur, prev, beacon = zip(*self.block_rows)
+        self.block_rows = []
+        channels = compute_channels(self.block, cur, prev, beacon, self.sampler.freq)
+        self.log.add_columns(channels)
+
     def process_sample(self, timestamp, sample):
+        if getattr(self.sampler, "encrypted", True):
+            p = GT7DataPacket(sample, staged=self.staged)
+        else:
+            # e.g. replaying a compressed capture
+            p = GT7DataPacket(sample, encrypted=False)
+        self.process_decrypted(timestamp, p)
+
+    def process_decrypted(self, timestamp, p):
 
-        p = GT7DataPacket(sample)
+        self.packets += 1
         if not self.last_packet:
             self.last_packet = p
             l.info(f"Primeiro pacote recebido do GT7: {p.tick}")
@@ -75,9 +207,21 @@ class GT7Logger(BaseLogger):
                 self.process_packet(timestamp, mp)
 
         self.process_packet(timestamp, p)
+        if not getattr(p, "decrypted", True):
+            # dropped before its body was ever decrypted
+            self.rejected_packets += 1
 
         self.last_packet = p
 
+    def save_log(self):
+        self.flush_block()
+        if self.log and self.staged:
+            l.info(f"Pacotes recebidos: {self.packets},"
+                   f" descartados antes de decodificar: {self.rejected_packets}")
+        elif self.log:
+            l.info(f"Pacotes recebidos: {self.packets}")
+        super().save_log()
+
     def process_packet(self, timestamp, packet):
 
         beacon = 0
@@ -86,8 +230,6 @@ class GT7Logger(BaseLogger):
         lastp = self.last_packet
         currp = packet
 
-        freq = self.sampler.freq
-
         if currp.paused:
             return
 
@@ -165,6 +307,20 @@ class GT7Logger(BaseLogger):
                 f" Last: {currp.last_laptime:6}ms"
             )
 
+        self.add_packet(beacon, lastp, currp)
+
+    def add_packet(self, beacon, lastp, currp):
+        if self.batch:
+            # only computed once the block is done
+            self.block_rows.append((currp.row, lastp.row, beacon))
+            self.lap_samples += 1
+        else:
+            self.add_samples(self.packet_samples(beacon, lastp, currp))
+
+    def packet_samples(self, beacon, lastp, currp):
+
+        freq = self.sampler.freq
+
         # do some conversions
         # gear, throttle, brake, speed, z, x
         lat, long = gps.convert(x=currp.position.x, z=-currp.position.z)
@@ -188,7 +344,7 @@ class GT7Logger(BaseLogger):
             wheelspeed = [r * s * ms_to_mph for r,
                           s in zip(currp.wheelradius, currp.wheelspeed)]
 
-        self.add_samples([
+        return [
             beacon,
             currp.current_lap,
             currp.rpm,
@@ -215,4 +371,4 @@ class GT7Logger(BaseLogger):
             currp.oil_pressure,
             currp.asm,
             currp.tcs
-        ])
+        ]
@@ -0,0 +1,183 @@
+from stm.sampler import BaseSampler
+from stm.samplequeue import DROP_OLDEST, BLOCK
+from .sampler import DEFAULT_PORT, DEFAULT_HEARTBEAT_PORT, PACKETSIZE
+from .aiosampler import HEARTBEAT_PACKETS
+from threading import Thread, Lock
+import selectors
+import socket
+import time
+from logging import getLogger
+l = getLogger(__name__)
+
+
+class GT7SourceSampler(BaseSampler):
+
+    """
+    the samples of one PlayStation captured by a GT7MultiSampler
+
+    Looks like any other sampler to a logger, but has no thread of its own:
+    starting it starts the shared receive thread and stopping it only stops
+    the shared thread once every source has been stopped.
+    """
+
+    def __init__(self, parent, addr, freq=None, maxsize=0, policy=DROP_OLDEST):
+        super().__init__(freq=freq, maxsize=maxsize, policy=policy)
+        self.parent = parent
+        self.addr = addr
+        self.hb_addr = None
+        self.last_hb = 0.0
+        self.packets = 0
+
+    def start(self):
+        self.running = True
+        self.parent.start_once()
+
+    def is_alive(self):
+        return self.running and self.parent.is_alive()
+
+    def join(self, timeout=None):
+        if not self.parent.running:
+            self.parent.join(timeout)
+
+    def stop(self):
+        l.warning(f"Finalizando o sampler de {self.addr}")
+        self.running = False
+        self.parent.source_stopped()
+
+
+class GT7MultiSampler(Thread):
+
+    """
+    capture several PlayStations from one thread
+
+    By default all the consoles send to one shared socket and the packets
+    are routed to a GT7SourceSampler per console by their source address.
+    Passing ports binds one socket per console instead, which only makes
+    sense when the packets are being redirected to different ports. All
+    the sockets are serviced with selectors and the heartbeats to every
+    console are sent on a timer. A full queue can't block, as the receive
+    thread is shared by every console.
+    """
+
+    def __init__(self, addrs, port=DEFAULT_PORT, hb_port=DEFAULT_HEARTBEAT_PORT, freq=None,
+                 maxsize=0, policy=DROP_OLDEST, ports=None):
+        if policy == BLOCK:
+            raise ValueError(f"the {BLOCK} policy would stall every console on one slow logger")
+
+        super().__init__()
+        self.freq = freq
+        self.running = False
+        self.start_lock = Lock()
+        self.hb_interval = HEARTBEAT_PACKETS / (freq or 60)
+        self.unknown = 0
+
+        self.sources = {}
+        # the packets come from an IP, the consoles may be given by name
+        self.routes = {}
+        self.selector = selectors.DefaultSelector()
+
+        if ports is None:
+            shared = self.bind(int(port))
+            self.selector.register(shared, selectors.EVENT_READ, None)
+
+        for idx, addr in enumerate(addrs):
+            source = GT7SourceSampler(self, addr, freq=freq, maxsize=maxsize, policy=policy)
+            self.sources[addr] = source
+            ip = socket.gethostbyname(addr)
+            self.routes[ip] = source
+
+            if ports is None:
+                source.socket = shared
+                source_port = int(port)
+            else:
+                source_port = int(ports[idx])
+                source.socket = self.bind(source_port)
+                self.selector.register(source.socket, selectors.EVENT_READ, source)
+
+            if source_port != DEFAULT_PORT:
+                # do not send heartbeats if we are not running on the default ports
+                # as GT7 will ignore them anyway
+                l.info(f"Redirecionando os pacotes UDP de {addr}.")
+            else:
+                source.hb_addr = (ip, hb_port)
+
+    @staticmethod
+    def bind(port):
+        # Create a UDP socket for the inbound packets
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # Set the SO_REUSEADDR option to allow immediate reuse of the port
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+        # Bind to any address
+        sock.bind(('0.0.0.0', port))
+        sock.setblocking(False)
+        return sock
+
+    def start_once(self):
+        with self.start_lock:
+            if not self.running and not self.is_alive():
+                self.running = True
+                self.start()
+
+    def source_stopped(self):
+        if not any(source.running for source in self.sources.values()):
+            self.running = False
+
+    def run(self):
+
+        self.running = True
+
+        while self.running:
+
+            now = time.monotonic()
+            for source in self.sources.values():
+                if now - source.last_hb >= self.hb_interval:
+                    self.send_hb(source)
+                    source.last_hb = now
+
+            for key, _ in self.selector.select(timeout=self.hb_interval):
+                self.receive(key.fileobj, key.data)
+
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+            key.fileobj.close()
+        self.selector.close()
+
+        for source in self.sources.values():
+            l.info(f"Recebidos {source.packets} pacotes de {source.addr}")
+
+        if self.unknown:
+            l.warning(f"Ignorados {self.unknown} pacotes de endereços desconhecidos")
+
+    def receive(self, sock, source):
+        # drain everything that is waiting on the socket
+        while True:
+            try:
+                data, addr = sock.recvfrom(PACKETSIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # e.g. ICMP port unreachable from a heartbeat on windows,
+                # back to the selector rather than spinning on the error
+                return
+
+            ts = time.time()
+            to = source or self.routes.get(addr[0])
+            if to is None or not to.running:
+                self.unknown += 1
+                continue
+
+            to.packets += 1
+            to.put((ts, data))
+
+    def send_hb(self, source):
+        if not source.hb_addr:
+            return
+
+        send_data = b'A'
+        try:
+            source.socket.sendto(send_data, source.hb_addr)
+        except Exception:
+            # sent again on the next timer
+            pass
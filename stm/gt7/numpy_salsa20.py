@@ -0,0 +1,188 @@
+# Vectorized Salsa20 built on NumPy uint32 lanes.
+#
+# Every 64-byte block of every message is one lane, so a whole GT7 packet
+# (5 blocks) or a whole batch of packets is permuted by the same 20 rounds
+# of array operations instead of per-word Python integer maths.
+
+import numpy as np
+
+SIGMA = np.frombuffer(b"expand 32-byte k", dtype="<u4")
+BLOCKSIZE = 64
+
+
+def key_words(key):
+    # This implementation doesn't support 16-byte keys.
+    assert len(key) == 32
+    return np.frombuffer(bytes(key), dtype="<u4")
+
+
+def nonce_words(nonces):
+    """
+    convert one 8 byte nonce or a (N, 8) uint8 / (N, 2) uint32 array of
+    nonces into a (N, 2) uint32 array
+    """
+    if isinstance(nonces, (bytes, bytearray, memoryview)):
+        assert len(nonces) == 8
+        return np.frombuffer(bytes(nonces), dtype="<u4").reshape(1, 2)
+
+    nonces = np.asarray(nonces)
+    if nonces.dtype == np.uint8:
+        nonces = np.ascontiguousarray(nonces).view("<u4")
+    return nonces.astype(np.uint32, copy=False).reshape(-1, 2)
+
+
+# The 16 state words are kept as four diagonal rows so that each half of a
+# double round is four array wide quarter rounds:
+#   A = x0  x5  x10 x15
+#   B = x4  x9  x14 x3
+#   C = x8  x13 x2  x7
+#   D = x12 x1  x6  x11
+# rolling B, C and D lines the rows up so the row round reuses the same code
+DIAGONALS = np.array([
+    [0, 5, 10, 15],
+    [4, 9, 14, 3],
+    [8, 13, 2, 7],
+    [12, 1, 6, 11],
+])
+ROLL_LEFT = [1, 2, 3, 0]
+ROLL_HALF = [2, 3, 0, 1]
+ROLL_RIGHT = [3, 0, 1, 2]
+SHIFTS = {n: (np.uint32(n), np.uint32(32 - n)) for n in (7, 9, 13, 18)}
+
+
+def _step(a, b, c, n, t, u):
+    # a ^= rotl(b + c, n)
+    left, right = SHIFTS[n]
+    np.add(b, c, out=t)
+    np.left_shift(t, left, out=u)
+    np.right_shift(t, right, out=t)
+    np.bitwise_or(t, u, out=t)
+    np.bitwise_xor(a, t, out=a)
+
+
+def _quarter_rounds(a, b, c, d, t, u):
+    _step(b, a, d, 7, t, u)
+    _step(c, b, a, 9, t, u)
+    _step(d, c, b, 13, t, u)
+    _step(a, d, c, 18, t, u)
+
+
+def salsa20_blocks(key, nonces, blocknums):
+    """
+    return the keystream words for the given block numbers of every nonce
+    as a (N, len(blocknums), 16) uint32 array
+    """
+    kw = key_words(key)
+    nw = nonce_words(nonces)
+    blocknums = np.asarray(blocknums, dtype=np.uint64).reshape(-1)
+
+    n = len(nw)
+    nb = len(blocknums)
+
+    # one column per block of every nonce
+    original = np.empty((16, n, nb), dtype=np.uint32)
+    original[[0, 5, 10, 15]] = SIGMA[:, None, None]
+    original[[1, 2, 3, 4]] = kw[0:4, None, None]
+    original[[11, 12, 13, 14]] = kw[4:8, None, None]
+    original[6] = nw[:, 0:1]
+    original[7] = nw[:, 1:2]
+    original[8] = (blocknums & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+    original[9] = (blocknums >> np.uint64(32)).astype(np.uint32)
+    original = original.reshape(16, n * nb)
+
+    a, b, c, d = original[DIAGONALS]
+    t = np.empty_like(a)
+    u = np.empty_like(a)
+
+    for doubleround in range(10):
+        # column round
+        _quarter_rounds(a, b, c, d, t, u)
+        # row round, the rolled rows swap the roles of B and D
+        b = b[ROLL_RIGHT]
+        c = c[ROLL_HALF]
+        d = d[ROLL_LEFT]
+        _quarter_rounds(a, d, c, b, t, u)
+        b = b[ROLL_LEFT]
+        c = c[ROLL_HALF]
+        d = d[ROLL_RIGHT]
+
+    x = np.empty_like(original)
+    x[DIAGONALS[0]] = a
+    x[DIAGONALS[1]] = b
+    x[DIAGONALS[2]] = c
+    x[DIAGONALS[3]] = d
+    x += original
+
+    return np.ascontiguousarray(x.reshape(16, n, nb).transpose(1, 2, 0))
+
+
+def salsa20_keystream(key, nonces, length, start=0):
+    """
+    return `length` bytes of keystream starting at byte offset `start`
+    (which must be block aligned) for each nonce as a (N, length) uint8 array
+    """
+    assert start % BLOCKSIZE == 0
+    first = start // BLOCKSIZE
+    nblocks = -(-length // BLOCKSIZE)
+    words = salsa20_blocks(key, nonces, np.arange(first, first + nblocks))
+    return words.view(np.uint8).reshape(len(words), -1)[:, :length]
+
+
+def salsa20_xor_many(messages, nonces, key, start=0):
+    """
+    decrypt/encrypt a (N, length) uint8 array of messages, one nonce per row
+    """
+    messages = np.asarray(messages, dtype=np.uint8)
+    stream = salsa20_keystream(key, nonces, messages.shape[1], start=start)
+    return messages ^ stream
+
+
+# to be compatible with pySalsa
+def Salsa20_xor(message, nonce, key):
+    message = np.frombuffer(message, dtype=np.uint8)
+    stream = salsa20_keystream(key, nonce, len(message))[0]
+    return np.bitwise_xor(message, stream).tobytes()
+
+
+def Salsa20_keystream(length, nonce, key):
+    return salsa20_keystream(key, nonce, length)[0].tobytes()
+
+
+if __name__ == "__main__":
+    # compare the available backends on a GT7 sized packet
+    #   python -m stm.gt7.numpy_salsa20
+    import os
+    import timeit
+    from . import pure_salsa20
+
+    KEY = b'Simulator Interface Packet GT7 ver 0.0'[0:32]
+    nonce = os.urandom(8)
+    packet = os.urandom(296)
+
+    backends = {
+        "numpy": Salsa20_xor,
+        "pure": pure_salsa20.Salsa20_xor,
+    }
+    try:
+        import salsa20
+        backends["salsa20"] = salsa20.Salsa20_xor
+    except ImportError:
+        pass
+
+    expected = pure_salsa20.Salsa20_xor(packet, nonce, KEY)
+    for name, fn in backends.items():
+        assert fn(packet, nonce, KEY) == expected, name
+        number = 200
+        t = timeit.timeit(lambda: fn(packet, nonce, KEY), number=number)
+        print(f"{name:8} {t / number * 1e6:10.1f} us/packet")
+
+    # the numpy backend really pays off when a batch shares the rounds
+    for count in (10, 100, 1000):
+        packets = np.frombuffer(os.urandom(296 * count), dtype=np.uint8)
+        packets = packets.reshape(count, 296)
+        nonces = np.frombuffer(os.urandom(8 * count), dtype=np.uint8)
+        nonces = nonces.reshape(count, 8)
+        number = 10
+        t = timeit.timeit(
+            lambda: salsa20_xor_many(packets, nonces, KEY), number=number)
+        print(f"numpy x{count:<5} {t / number / count * 1e6:7.1f} us/packet")
@@ -0,0 +1,56 @@
+import os
+import unittest
+
+try:
+    import numpy as np
+    from stm.gt7 import numpy_salsa20
+except ImportError:
+    np = None
+
+from stm.gt7 import pure_salsa20
+
+KEY = b'Simulator Interface Packet GT7 ver 0.0'[0:32]
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class NumpySalsa20Test(unittest.TestCase):
+
+    def test_keystream(self):
+        nonce = os.urandom(8)
+        for length in (1, 4, 63, 64, 65, 296, 1000):
+            expected = bytes(pure_salsa20.salsa20_stream(KEY, nonce, length))
+            self.assertEqual(numpy_salsa20.Salsa20_keystream(length, nonce, KEY), expected, length)
+
+    def test_keystream_offsets(self):
+        nonce = os.urandom(8)
+        expected = bytes(pure_salsa20.salsa20_stream(KEY, nonce, 320))
+        for start in (64, 128, 192, 256):
+            for length in (1, 40, 64, 320 - start):
+                stream = numpy_salsa20.salsa20_keystream(KEY, nonce, length, start=start)
+                self.assertEqual(stream[0].tobytes(), expected[start:start + length], (start, length))
+
+    def test_block_counter(self):
+        # the counter is split over two words
+        nonce = os.urandom(8)
+        blocknums = [0, 1, 2**32 - 1, 2**32, 2**32 + 5, 2**63]
+        words = numpy_salsa20.salsa20_blocks(KEY, nonce, blocknums)
+        for blocknum, block in zip(blocknums, words[0]):
+            self.assertEqual(block.astype("<u4").tobytes(),
+                             pure_salsa20.salsa20_block(KEY, nonce, blocknum), blocknum)
+
+    def test_xor_many(self):
+        count = 7
+        messages = np.frombuffer(os.urandom(296 * count), dtype=np.uint8).reshape(count, 296)
+        nonces = np.frombuffer(os.urandom(8 * count), dtype=np.uint8).reshape(count, 8)
+        result = numpy_salsa20.salsa20_xor_many(messages, nonces, KEY)
+        for message, nonce, row in zip(messages, nonces, result):
+            expected = pure_salsa20.Salsa20_xor(message.tobytes(), nonce.tobytes(), KEY)
+            self.assertEqual(row.tobytes(), bytes(expected))
+
+        message = messages[0].tobytes()
+        self.assertEqual(numpy_salsa20.Salsa20_xor(message, nonces[0].tobytes(), KEY),
+                         bytes(pure_salsa20.Salsa20_xor(message, nonces[0].tobytes(), KEY)))
+
+
+if __name__ == "__main__":
+    unittest.main()
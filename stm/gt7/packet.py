@@ -1,7 +1,34 @@
+# keystream(nonce, key, start, length) returns the block aligned part of the
+# keystream used by the staged decrypt, so it only has to decrypt the blocks
+# holding the fields it needs
 try:
-    from salsa20 import Salsa20_xor
+    from salsa20 import Salsa20_xor, Salsa20_keystream
+    BACKEND = "salsa20"
+
+    def keystream(nonce, key, start, length):
+        return Salsa20_keystream(start + length, nonce, key)[start:]
 except:
-    from .pure_salsa20 import Salsa20_xor
+    try:
+        from .numpy_salsa20 import Salsa20_xor, salsa20_keystream
+        BACKEND = "numpy"
+
+        def keystream(nonce, key, start, length):
+            return salsa20_keystream(key, nonce, length, start=start)[0].tobytes()
+    except:
+        from .pure_salsa20 import Salsa20_xor, salsa20_block
+        BACKEND = "pure"
+
+        def keystream(nonce, key, start, length):
+            first = start // BLOCKSIZE
+            last = (start + length - 1) // BLOCKSIZE
+            stream = b"".join(salsa20_block(key, nonce, n) for n in range(first, last + 1))
+            return stream[:length]
+
+try:
+    import numpy as np
+    from . import numpy_salsa20
+except ImportError:
+    np = None
 
 import struct
 from enum import Enum
@@ -10,6 +37,12 @@ from stm.maths import Vector, Quaternion
 
 Wheels = namedtuple("Wheels", ["fl", "fr", "rl", "rr"])
 
+BLOCKSIZE = 64 # Salsa20 block
+
+# the staged decrypt only pays off when the cost of the backend grows with
+# the number of blocks, salsa20 and numpy are dominated by the per call cost
+STAGED_DECRYPT = BACKEND == "pure"
+
 class Flags(Enum):
     IN_RACE   = 0b0000000000000001
     PAUSED    = 0b0000000000000010
@@ -24,6 +57,11 @@ class Flags(Enum):
     ASM       = 0b0000010000000000
     TCS       = 0b0000100000000000
 
+IN_RACE = Flags.IN_RACE.value
+PAUSED = Flags.PAUSED.value
+ASM = Flags.ASM.value
+TCS = Flags.TCS.value
+
 class GT7DataPacket:
 
     # https://www.gtplanet.net/forum/threads/gt7-is-compatible-with-motion-rig.410728/page-4#post-13799643
@@ -75,11 +113,100 @@ class GT7DataPacket:
 
     size = fmt.size
 
-    def __init__(self, buf, encrypted=True):
+    key = b'Simulator Interface Packet GT7 ver 0.0'[0:32]
+    magic = 0x47375330
+
+    # fields are only unpacked when first accessed, see __getattr__
+    # tick and flags are enough to decide if a packet is used at all so they
+    # are decoded on their own, everything else is decoded in one go
+    tick_fmt = struct.Struct("<i")   # TICK  / 0x0070
+    flags_fmt = struct.Struct("<H")  # FLAGS / 0x008E
+
+    body = (
+        "position", "velocity", "rotation",
+        "ride_height", "rpm", "current_fuel", "speed",
+        "turbo_boost", "oil_pressure", "tyretemp",
+        "current_lap", "laps", "best_laptime", "last_laptime",
+        "race_position", "rev_upshift", "rev_limit", "opponents",
+        "gear", "suggested_gear", "throttle", "brake",
+        "wheelspeed", "wheelradius", "suspension",
+        "car_code",
+    )
+
+    __slots__ = (
+        "_buf", "_raw", "_nonce", "_pending",
+        "tick",
+        "flags", "paused", "in_race", "asm", "tcs",
+        *body
+    )
+
+    def __init__(self, buf, encrypted=True, staged=False):
+
+        # bitmask of the Salsa20 blocks of _buf that are still encrypted
+        self._pending = 0
+
+        if encrypted and staged:
+            self._decrypt_staged(buf)
+            return
 
         if encrypted:
             buf = self.decrypt(buf)
 
+        if len(buf) != self.size:
+            raise struct.error(f"unpack requires a buffer of {self.size} bytes")
+
+        # decrypt already checked it, a replayed packet may not have been
+        if not encrypted and int.from_bytes(buf[0:4], byteorder='little') != self.magic:
+            raise struct.error("invalid magic number")
+
+        self._buf = memoryview(buf)
+
+    def __getattr__(self, name):
+        # only called when the slot has not been filled in yet
+        if name == "tick":
+            if self._pending:
+                self._decrypt_range(0x0070, 0x0074)
+            (self.tick, ) = self.tick_fmt.unpack_from(self._buf, 0x0070)
+        elif name in ("flags", "paused", "in_race", "asm", "tcs"):
+            if self._pending:
+                self._decrypt_range(0x008E, 0x0090)
+            self._decode_flags()
+        elif name in self.body:
+            if self._pending:
+                self._decrypt_range(0, self.size)
+            self._decode_body()
+        else:
+            raise AttributeError(
+                f"'{type(self).__name__}' object has no attribute '{name}'")
+        return getattr(self, name)
+
+    def __copy__(self):
+        # the default copy reads every slot, which would decode and decrypt
+        # the whole packet through __getattr__, only take the filled ones
+        cls = type(self)
+        packet = cls.__new__(cls)
+        for name in cls.__slots__:
+            try:
+                value = object.__getattribute__(self, name)
+            except AttributeError:
+                continue
+            object.__setattr__(packet, name, value)
+
+        if self._pending:
+            # the blocks are decrypted in place, so each copy needs its own
+            packet._buf = memoryview(bytearray(self._buf))
+        return packet
+
+    def _decode_flags(self):
+        (flags, ) = self.flags_fmt.unpack_from(self._buf, 0x008E)
+        self.flags = flags
+        self.paused = bool(flags & PAUSED)
+        self.in_race = bool(flags & IN_RACE)
+
+        self.asm = bool(flags & ASM)
+        self.tcs = bool(flags & TCS)
+
+    def _decode_body(self):
         (
             px, py, pz,
             vx, vy, vz,
@@ -91,7 +218,7 @@ class GT7DataPacket:
             self.turbo_boost,
             self.oil_pressure,
             ttfl, ttfr, ttrl, ttrr,
-            self.tick,
+            _,
             self.current_lap, # De onde vem? [19]
             self.laps,
             self.best_laptime,
@@ -100,7 +227,7 @@ class GT7DataPacket:
             self.rev_upshift,
             self.rev_limit,
             self.opponents, # De onde vem? [26]
-            self.flags,
+            _,
             gear,
             self.throttle,
             self.brake,
@@ -108,7 +235,7 @@ class GT7DataPacket:
             wrfl, wrfr, wrrl, wrrr,
             susfl, susfr, susrl, susrr,
             self.car_code
-        )  = self.fmt.unpack(buf)
+        )  = self.fmt.unpack_from(self._buf)
 
         self.position = Vector(px, py, pz)
         self.velocity = Vector(vx, vy, vz)
@@ -122,25 +249,127 @@ class GT7DataPacket:
         self.gear = gear & 0x0F
         self.suggested_gear = (gear & 0xF0) >> 4
 
-        self.paused = bool(self.flags & Flags.PAUSED.value)
-        self.in_race = bool(self.flags & Flags.IN_RACE.value)
+    @property
+    def decrypted(self):
+        """
+        False while a staged packet still has encrypted blocks
+        """
+        return not self._pending
+
+    def _decrypt_staged(self, dat):
+        # Salsa20 is a stream cipher, so every 64 byte block can be decrypted
+        # on its own. Only decrypt block 0 now to check the magic number, the
+        # rest is decrypted as the fields in it are accessed: tick is in
+        # block 1, flags in block 2 and the rest of the fields all over
+        if len(dat) != self.size:
+            raise struct.error(f"unpack requires a buffer of {self.size} bytes")
+
+        self._raw = bytes(dat)
+        self._nonce = self.nonce(dat)
+        self._buf = memoryview(bytearray(self.size))
+        self._pending = (1 << -(-self.size // BLOCKSIZE)) - 1
 
-        self.asm = bool(self.flags & Flags.ASM.value)
-        self.tcs = bool(self.flags & Flags.TCS.value)
+        self._decrypt_range(0, 4)
+        magic = int.from_bytes(self._buf[0:4], byteorder='little')
+        if magic != self.magic:
+            raise struct.error("invalid magic number")
+
+    def _decrypt_range(self, start, end):
+        first = start // BLOCKSIZE
+        last = (end - 1) // BLOCKSIZE
+        todo = self._pending & (((1 << (last + 1)) - 1) ^ ((1 << first) - 1))
+        if not todo:
+            return
+
+        # decrypt the run of blocks covering everything still to do
+        first = (todo & -todo).bit_length() - 1
+        last = todo.bit_length() - 1
+        start = first * BLOCKSIZE
+        end = min((last + 1) * BLOCKSIZE, self.size)
+        length = end - start
+
+        stream = keystream(self._nonce, self.key, start, length)
+        data = int.from_bytes(self._raw[start:end], byteorder='little')
+        data ^= int.from_bytes(stream, byteorder='little')
+        self._buf[start:end] = data.to_bytes(length, byteorder='little')
+
+        self._pending &= ~(((1 << (last + 1)) - 1) ^ ((1 << first) - 1))
 
     @staticmethod
-    def decrypt(dat):
-        KEY = b'Simulator Interface Packet GT7 ver 0.0'
+    def nonce(dat):
         oiv = dat[0x40:0x44]
         iv1 = int.from_bytes(oiv, byteorder='little')
         iv2 = iv1 ^ 0xDEADBEAF 
         IV = bytearray()
         IV.extend(iv2.to_bytes(4, 'little'))
         IV.extend(iv1.to_bytes(4, 'little'))
-        ddata = Salsa20_xor(dat, bytes(IV), KEY[0:32])
+        return bytes(IV)
+
+    @classmethod
+    def decrypt(cls, dat):
+        dat = bytes(dat) # salsa20 only takes bytes, not views
+        ddata = Salsa20_xor(dat, cls.nonce(dat), cls.key)
 
         #check magic number
         magic = int.from_bytes(ddata[0:4], byteorder='little')
-        if magic != 0x47375330:
+        if magic != cls.magic:
             return bytearray(b'')
-        return ddata
\ No newline at end of file
+        return ddata
+
+    @classmethod
+    def decrypt_many(cls, buffers):
+        """
+        decrypt a batch of packets in one vectorized pass
+
+        buffers is either a list of equally sized packets or a 2-D (N, size)
+        uint8 array/buffer. Returns a boolean mask of the packets with a valid
+        magic number and the (N, size) uint8 array of decrypted packets
+        """
+        if np is None:
+            raise ImportError("numpy is required to decrypt packets in batches")
+
+        if isinstance(buffers, (list, tuple)):
+            if not buffers:
+                return np.zeros(0, dtype=bool), np.zeros((0, cls.size), dtype=np.uint8)
+            if len(set(len(b) for b in buffers)) > 1:
+                raise ValueError("all the packets in a batch must have the same size")
+            dat = np.frombuffer(b"".join(buffers), dtype=np.uint8)
+            dat = dat.reshape(len(buffers), -1)
+        else:
+            dat = np.asarray(buffers, dtype=np.uint8)
+            if dat.ndim != 2:
+                raise ValueError("expected a 2-D buffer of packets")
+
+        if not len(dat):
+            return np.zeros(0, dtype=bool), np.zeros((0, cls.size), dtype=np.uint8)
+
+        # same IV/nonce as decrypt, just one row per packet
+        iv1 = np.ascontiguousarray(dat[:, 0x40:0x44]).view("<u4")[:, 0]
+        iv2 = iv1 ^ np.uint32(0xDEADBEAF)
+        nonces = np.stack([iv2, iv1], axis=1)
+        ddata = numpy_salsa20.salsa20_xor_many(dat, nonces, cls.key)
+
+        magic = np.ascontiguousarray(ddata[:, 0:4]).view("<u4")[:, 0]
+        return magic == cls.magic, ddata
+
+def packet_tick(dat):
+    """
+    tick of an encrypted packet, only decrypting the blocks needed for it,
+    or -1 for a packet with a bad magic number
+    """
+    try:
+        return GT7DataPacket(dat, staged=True).tick
+    except struct.error:
+        return -1
+
+
+def decrypt_packets(packets):
+    """
+    decrypt a list of packets, batched when numpy is the fastest backend,
+    with an empty bytes for a bad magic number like GT7DataPacket.decrypt
+    """
+    if BACKEND == "salsa20" or np is None or len(set(map(len, packets))) > 1:
+        return [bytes(GT7DataPacket.decrypt(dat)) for dat in packets]
+
+    valid, ddata = GT7DataPacket.decrypt_many(packets)
+    return [row.tobytes() if ok else b'' for ok, row in zip(valid, ddata)]
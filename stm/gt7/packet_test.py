@@ -0,0 +1,39 @@
+import unittest
+from copy import copy
+
+from stm.gt7.packet import GT7DataPacket
+from stm.rawfile_test import make_packet
+
+
+def filled(packet, name):
+    try:
+        object.__getattribute__(packet, name)
+    except AttributeError:
+        return False
+    return True
+
+
+class GT7DataPacketTest(unittest.TestCase):
+
+    def test_copy(self):
+        for staged in (False, True):
+            packet = GT7DataPacket(make_packet(42), staged=staged)
+            self.assertEqual(packet.tick, 42)
+
+            missing = copy(packet)
+            missing.tick = 43
+
+            # the copy leaves the original as it was
+            self.assertFalse(filled(packet, "position"))
+            self.assertEqual(packet.decrypted, not staged)
+            self.assertEqual(packet.tick, 42)
+
+            self.assertEqual(missing.tick, 43)
+            self.assertAlmostEqual(missing.rpm, 4.2, places=5)
+            self.assertTrue(missing.decrypted)
+            self.assertEqual(packet.decrypted, not staged)
+            self.assertEqual(packet.rpm, missing.rpm)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+from stm.sampler import BaseSampler
+from .sampler import DEFAULT_PORT, DEFAULT_HEARTBEAT_PORT, PACKETSIZE
+from multiprocessing import shared_memory
+from queue import Empty
+import multiprocessing
+import socket
+import struct
+import time
+from logging import getLogger
+l = getLogger(__name__)
+
+# layout of the shared memory:
+#   counters  head, tail, overruns as uint64, each written by one side only
+#   slots     timestamp f8, length u4, padding, datagram
+COUNTERS = 4
+HEAD, TAIL, OVERRUNS = 0, 1, 2
+HEADER = COUNTERS * 8
+SLOT_HEADER = struct.Struct("<dI4x")
+SLOTSIZE = SLOT_HEADER.size + PACKETSIZE
+DEFAULT_SLOTS = 1024
+
+
+def slot_views(buf, slots):
+    offsets = [HEADER + slot * SLOTSIZE for slot in range(slots)]
+    return ([buf[o:o + SLOT_HEADER.size] for o in offsets],
+            [buf[o + SLOT_HEADER.size:o + SLOTSIZE] for o in offsets])
+
+
+def receive(name, slots, port, hb_addr, ready, stopped):
+    """
+    body of the capture process, receives the datagrams straight into the
+    shared ring and signals every new one on the ready semaphore
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    counters = shm.buf[:HEADER].cast("Q")
+    headers, datas = slot_views(shm.buf, slots)
+
+    # Create a UDP socket for the inbound packets
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Set the SO_REUSEADDR option to allow immediate reuse of the port
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    # Bind to any address
+    sock.bind(('0.0.0.0', port))
+    sock.settimeout(0.5)
+
+    def send_hb():
+        if not hb_addr:
+            return
+        try:
+            sock.sendto(b'A', hb_addr)
+        except Exception:
+            pass
+
+    # used to drain the socket when the ring is full
+    scratch = bytearray(PACKETSIZE)
+
+    try:
+        send_hb()
+        pkt_count = 0
+
+        while not stopped.is_set():
+            head = counters[HEAD]
+            try:
+                if head - counters[TAIL] >= slots:
+                    sock.recv_into(scratch, PACKETSIZE)
+                    counters[OVERRUNS] += 1
+                    continue
+
+                slot = head % slots
+                size = sock.recv_into(datas[slot], PACKETSIZE)
+                SLOT_HEADER.pack_into(headers[slot], 0, time.time(), size)
+                counters[HEAD] = head + 1
+                ready.release()
+                pkt_count += 1
+
+                if (pkt_count % 100) == 0:
+                    # send a heartbeat about every 6 seconds
+                    send_hb()
+
+            except socket.timeout:
+                send_hb()
+    finally:
+        sock.close()
+        for view in headers + datas:
+            view.release()
+        counters.release()
+        shm.close()
+
+
+class GT7ProcessSampler(BaseSampler):
+
+    """
+    GT7Sampler receiving in a child process
+
+    The child process only receives the datagrams and sends the heartbeats,
+    writing the packets into a ring of slots in shared memory, so a logger
+    busy converting or uploading a log never delays the reception. The
+    packets are copied out of the ring as they are taken, so the slots are
+    free again as soon as get/get_many return.
+    """
+
+    def __init__(self, addr=None, port=DEFAULT_PORT, hb_port=DEFAULT_HEARTBEAT_PORT, freq=None, slots=0):
+        super().__init__(freq=freq)
+        self.port = int(port)
+        if self.port != DEFAULT_PORT:
+            # do not send heartbeats if we are not running on the default ports
+            # as GT7 will ignore them anyway
+            self.hb_addr = None
+            l.info("Redirecionando os pacotes UDP.")
+        else:
+            self.hb_addr = (addr, hb_port)
+
+        self.slots = int(slots or DEFAULT_SLOTS)
+        self.shm = shared_memory.SharedMemory(create=True, size=HEADER + self.slots * SLOTSIZE)
+        self.counters = self.shm.buf[:HEADER].cast("Q")
+        for i in range(COUNTERS):
+            self.counters[i] = 0
+        self.headers, self.datas = slot_views(self.shm.buf, self.slots)
+
+        self.ready = multiprocessing.Semaphore(0)
+        self.stopped = multiprocessing.Event()
+        self.process = None
+        self.overruns = 0
+        self.max_queued = 0
+
+    @property
+    def dropped(self):
+        return self.overruns
+
+    @property
+    def high_water(self):
+        return self.max_queued
+
+    def run(self):
+        self.process = multiprocessing.Process(
+            target=receive, daemon=True,
+            args=(self.shm.name, self.slots, self.port, self.hb_addr, self.ready, self.stopped))
+
+        self.running = True  # this is set to False in BaseSampler when we are done
+        self.process.start()
+
+        while self.running and self.process.is_alive():
+            self.process.join(0.5)
+
+        self.stopped.set()
+        self.process.join()
+
+        if self.process.exitcode:
+            l.error(f"O processo de captura terminou com o código {self.process.exitcode}")
+
+        self.overruns = self.counters[OVERRUNS]
+
+    def get(self, timeout=None):
+        return self.get_many(maxitems=1, timeout=timeout)[0]
+
+    def get_many(self, maxitems=None, timeout=None):
+        if not self.ready.acquire(timeout=timeout):
+            raise Empty
+
+        counters = self.counters
+        tail = counters[TAIL]
+        queued = counters[HEAD] - tail
+        if queued > self.max_queued:
+            self.max_queued = queued
+
+        maxitems = min(maxitems or self.slots, queued)
+        count = 1
+        while count < maxitems and self.ready.acquire(False):
+            count += 1
+
+        samples = []
+        for i in range(tail, tail + count):
+            slot = i % self.slots
+            ts, size = SLOT_HEADER.unpack_from(self.headers[slot])
+            samples.append((ts, bytes(self.datas[slot][:size])))
+
+        counters[TAIL] = tail + count
+        return samples
+
+    def join(self, timeout=None):
+        super().join(timeout)
+        if not self.is_alive():
+            self.close()
+
+    def close(self):
+        if not self.shm:
+            return
+
+        for view in self.headers + self.datas:
+            view.release()
+        self.counters.release()
+        self.headers = self.datas = []
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
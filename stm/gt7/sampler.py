@@ -1,4 +1,6 @@
 from stm.sampler import BaseSampler
+from stm.samplequeue import DROP_OLDEST
+from collections import deque
 import socket
 import time
 from logging import getLogger
@@ -11,8 +13,9 @@ PACKETSIZE = 1500
 
 class GT7Sampler(BaseSampler):
 
-    def __init__(self, addr=None, port=DEFAULT_PORT, hb_port=DEFAULT_HEARTBEAT_PORT, freq=None):
-        super().__init__(freq=freq)
+    def __init__(self, addr=None, port=DEFAULT_PORT, hb_port=DEFAULT_HEARTBEAT_PORT, freq=None, slots=0,
+                 maxsize=0, policy=DROP_OLDEST):
+        super().__init__(freq=freq, maxsize=maxsize, policy=policy)
         port = int(port)
         if port != DEFAULT_PORT:
             # do not send heartbeats if we are not running on the default ports
@@ -32,7 +35,33 @@ class GT7Sampler(BaseSampler):
         self.socket.bind(('0.0.0.0', port))
         self.socket.settimeout(1)
 
+        # optional ring of preallocated receive slots, the consumer is
+        # handed a view of the slot instead of a new bytes per datagram
+        self.slots = int(slots or 0)
+        self.overruns = 0
+        if self.slots:
+            self.ring = bytearray(self.slots * PACKETSIZE)
+            view = memoryview(self.ring)
+            self.views = [view[i * PACKETSIZE:(i + 1) * PACKETSIZE]
+                          for i in range(self.slots)]
+            self.timestamps = [0.0] * self.slots
+            self.lengths = [0] * self.slots
+            self.free = deque(range(self.slots))
+            self.held = []
+            # slots dropped by the queue go straight back to the ring
+            self.samples.on_drop = self.free.append
+
+    @property
+    def dropped(self):
+        # a packet lost with every slot in use is as dropped as one pushed
+        # out of a full queue
+        return self.samples.dropped + self.overruns
+
     def run(self):
+        if self.slots:
+            self.run_ring()
+            return
+
 
         self.running = True  # this is set to False in BaseSampler when we are done
         #
@@ -55,6 +84,74 @@ class GT7Sampler(BaseSampler):
             except socket.timeout:
                 self.send_hb()
 
+    def run_ring(self):
+
+        self.running = True
+        #
+        self.send_hb()
+        pkt_count = 0
+
+        # used to drain the socket when the consumer holds every slot
+        scratch = memoryview(bytearray(PACKETSIZE))
+
+        while self.running:
+            try:
+                slot = self.free.popleft()
+            except IndexError:
+                slot = None
+
+            try:
+                if slot is None:
+                    self.socket.recv_into(scratch, PACKETSIZE)
+                    self.overruns += 1
+                    continue
+
+                size = self.socket.recv_into(self.views[slot], PACKETSIZE)
+                self.timestamps[slot] = time.time()
+                self.lengths[slot] = size
+                pkt_count += 1
+
+                if (pkt_count % 100) == 0:
+                    # send a heartbeat about every 6 seconds
+                    self.send_hb()
+
+                self.put(slot)
+
+            except socket.timeout:
+                if slot is not None:
+                    self.free.appendleft(slot)
+                self.send_hb()
+
+        if self.overruns:
+            l.warning(f"Descartados {self.overruns} pacotes com o buffer circular cheio")
+
+    def get(self, timeout=None):
+        if not self.slots:
+            return super().get(timeout=timeout)
+
+        self.release()
+        slot = super().get(timeout=timeout)
+        self.held.append(slot)
+        return (self.timestamps[slot], self.views[slot][:self.lengths[slot]])
+
+    def get_many(self, maxitems=None, timeout=None):
+        if not self.slots:
+            return super().get_many(maxitems=maxitems, timeout=timeout)
+
+        # leave the receiver at least half of the ring while we hold a batch
+        maxitems = min(maxitems or self.slots, max(1, self.slots // 2))
+
+        self.release()
+        slots = super().get_many(maxitems=maxitems, timeout=timeout)
+        self.held = slots
+        return [(self.timestamps[slot], self.views[slot][:self.lengths[slot]]) for slot in slots]
+
+    def release(self):
+        # the slots are handed back once the consumer asks for more, so a
+        # sample is only valid until the next call to get/get_many
+        self.free.extend(self.held)
+        self.held = []
+
     def send_hb(self):
         if not self.hb_addr:
             return
@@ -1,6 +1,20 @@
 import struct
 import binascii
+from array import array
 from io import BytesIO
+import mmap
+import os
+import shutil
+import tempfile
+from .ldx import MotecLogExtra
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# samples per channel kept in memory when spilling, a minute at 60Hz
+SPILL_SAMPLES = 3600
 
 class MotecStruct:
 
@@ -121,12 +135,16 @@ class MotecSamples():
 
     }
 
-    def __init__(self, channel = None, samples = None):
-        if samples:
-            self.samples = samples
-        else:
-            self.samples = []
+    # how the samples are held until they are packed, the int channels
+    # switch to doubles as soon as they get a float or a value too large
+    storagetypes = {
+        0x0000: "i",
+        0x0003: "i",
+        0x0005: "i",
+        0x0007: "d",
+    }
 
+    def __init__(self, channel = None, samples = None):
         try:
             self.channel = channel
             self.fmt = self.datatypes[channel.datatype][channel.datasize]
@@ -136,17 +154,124 @@ class MotecSamples():
             self.shift = channel.shift
             self.scale = channel.scale
             self.decplaces = channel.decplaces
+            typecode = self.storagetypes[channel.datatype]
         except Exception as e:
             raise ValueError(f"failed to determine samples for {channel.datatype} / {channel.datasize}")
 
+        self.samples = array(typecode)
+        if samples:
+            self.add_samples(samples)
+
+        # samples already encoded into the spill file
+        self.spillfile = None
+        self.spilled = 0
+
     @property
     def numsamples(self):
-        return len(self.samples)
+        return self.spilled + len(self.samples)
+
+    @property
+    def nbytes(self):
+        return self.samples.itemsize * len(self.samples)
+
+    def widen(self):
+        """
+        switch the storage to doubles
+        """
+        if self.samples.typecode != "d":
+            self.samples = array("d", self.samples)
 
     def add_sample(self, sample):
-        self.samples.append(sample)
+        try:
+            self.samples.append(sample)
+        except (TypeError, OverflowError):
+            if self.samples.typecode == "d":
+                raise
+            self.widen()
+            self.samples.append(sample)
+
+    def add_samples(self, samples):
+        if np is not None and isinstance(samples, np.ndarray):
+            self.add_array(samples)
+            return
+
+        count = len(self.samples)
+        try:
+            self.samples.extend(samples)
+        except (TypeError, OverflowError):
+            if self.samples.typecode == "d":
+                raise
+            # drop whatever went in before the failing sample
+            del self.samples[count:]
+            self.widen()
+            self.samples.extend(samples)
+
+    def add_array(self, samples):
+        # straight from the numpy buffer, without a python object per sample
+        dtype = np.dtype(self.samples.typecode)
+        if dtype.kind == "i":
+            info = np.iinfo(dtype)
+            if samples.dtype.kind not in "biu" or (
+                    samples.size and (samples.min() < info.min or samples.max() > info.max)):
+                self.widen()
+                dtype = np.dtype("d")
+        self.samples.frombytes(samples.astype(dtype).tobytes())
+
+    def spill(self, filename, append = False):
+        """
+        from now on flush() moves the samples to filename, append to pick up
+        the spill file of a checkpoint
+        """
+        self.spillfile = open(filename, "r+b" if append else "w+b")
+
+    def flush(self):
+        """
+        encode the samples held in memory and append them to the spill file
+        """
+        if not self.spillfile or not len(self.samples):
+            return
+
+        self.spillfile.seek(0, os.SEEK_END)
+        self.spillfile.write(self.pack())
+        self.spilled += len(self.samples)
+        self.samples = array(self.samples.typecode)
+
+    def close(self):
+        """
+        drop the spill file
+        """
+        if not self.spillfile:
+            return
+
+        self.spillfile.close()
+        os.remove(self.spillfile.name)
+        self.spillfile = None
+        self.spilled = 0
+
+    def write(self, f):
+        """
+        write the encoded samples to a file object, spilled ones first
+        """
+        if self.spillfile:
+            self.spillfile.flush()
+            self.spillfile.seek(0)
+            shutil.copyfileobj(self.spillfile, f)
+        f.write(self.pack())
 
     def to_string(self):
+        data = BytesIO()
+        self.write(data)
+        return bytearray(data.getbuffer())
+
+    def pack(self):
+        """
+        encode the samples held in memory
+        """
+        if np is not None:
+            data = self.encode()
+            if data is not None:
+                return data
+
         data = bytearray()
         for v in self.samples:
             v = ( (v / self.multiplier) - self.shift) * self.scale / pow(10.0, -self.decplaces)
@@ -155,6 +280,40 @@ class MotecSamples():
 
         return data
 
+    def encode(self):
+        """
+        same bytes as the to_string loop in one pass with numpy, or None
+        when a sample can't be packed so the loop raises the same error
+        """
+        values = np.asarray(self.samples)
+        if values.dtype.kind not in "biuf":
+            return None
+        if values.dtype.kind in "iu" and values.size and np.abs(values).max() > 2 ** 53:
+            # past the ints a float64 holds exactly
+            return None
+
+        values = values.astype(np.float64)
+        values = ((values / self.multiplier) - self.shift) * self.scale / pow(10.0, -self.decplaces)
+
+        dtype = np.dtype(self.fmt)
+        if self.convert is int:
+            if not np.isfinite(values).all():
+                return None
+            # int() truncates towards zero
+            values = np.trunc(values)
+            info = np.iinfo(dtype)
+            if values.size and (values.min() < info.min or values.max() > info.max):
+                return None
+            encoded = values.astype(dtype)
+        else:
+            with np.errstate(over="ignore"):
+                encoded = values.astype(dtype)
+            if (np.isinf(encoded) != np.isinf(values)).any():
+                # too large for the float size
+                return None
+
+        return bytearray(encoded.tobytes())
+
     @classmethod
     def from_string(cls, data, channel = None):
 
@@ -163,6 +322,10 @@ class MotecSamples():
 
         samples = cls(channel=channel)
 
+        if np is not None:
+            samples.add_samples(channel.decode(data, channel.datapos, channel.numsamples))
+            return samples
+
         # go to the start of the data and unpack all the values
         startpos = channel.datapos
         endpos = startpos + (samples.datasize * channel.numsamples)
@@ -201,18 +364,88 @@ class MotecChannel(MotecBase):
         if not getattr(self, "samples", None):
             self.samples = MotecSamples(channel=self)
 
+    def __getattr__(self, name):
+        # the samples of a lazily read channel are only decoded when used
+        data = self.__dict__.get("data")
+        if name == "samples" and data is not None:
+            self.samples = MotecSamples.from_string(data, self)
+            return self.samples
+        raise AttributeError(name)
+
+    @property
+    def lazy(self):
+        return "samples" not in self.__dict__
+
+    @property
+    def dtype(self):
+        # how the samples are stored in the file
+        return np.dtype("<" + MotecSamples.datatypes[self.datatype][self.datasize])
+
+    def read(self, start = 0, stop = None):
+        """
+        the samples from start to stop as they are in the .ld file, scaled
+        into a float64 numpy array. A lazily read channel only decodes that
+        range of its file, otherwise the samples are encoded first
+        """
+        if self.lazy:
+            return self.decode(self.data, self.datapos, self.numsamples, start, stop)
+        return self.decode(self.samples.to_string(), 0, self.samples.numsamples, start, stop)
+
+    def decode(self, data, offset, numsamples, start = 0, stop = None):
+        """
+        scale the samples from start to stop of the numsamples encoded at
+        offset of data into a float64 numpy array
+        """
+        if np is None:
+            raise ImportError("numpy is required to read the samples into arrays")
+
+        start, stop, _ = slice(start, stop).indices(numsamples)
+        count = max(stop - start, 0)
+        dtype = self.dtype
+        v = np.frombuffer(data, dtype=dtype, count=count, offset=offset + start * dtype.itemsize)
+        v = v.astype(np.float64)
+        return (v / self.scale * pow(10., -self.decplaces) + self.shift) * self.multiplier
+
+    @property
+    def values(self):
+        """
+        all the samples as a float64 numpy array, decoded on first use
+        """
+        values = self.__dict__.get("_values")
+        if values is None:
+            values = self._values = self.read()
+        return values
+
+    def close(self):
+        if not self.lazy:
+            self.samples.close()
+        self.data = None
+
     def add_sample(self, sample):
         self.samples.add_sample(sample)
 
+    def add_samples(self, samples):
+        self.samples.add_samples(samples)
+
+    @property
+    def pending(self):
+        # samples not spilled yet
+        return len(self.samples.samples)
+
     def to_string(self):
         self.numsamples = self.samples.numsamples
         return super().to_string()
 
     @classmethod
-    def from_string(cls, data, start = 0, pad = False):
+    def from_string(cls, data, start = 0, pad = False, lazy = False):
         # the log has to start from zero
         channel = super().from_string(data, start=start, pad=pad)
-        channel.samples = MotecSamples.from_string(data, channel)
+        if lazy:
+            # keep the data to decode the samples from when they are used
+            del channel.samples
+            channel.data = data
+        else:
+            channel.samples = MotecSamples.from_string(data, channel)
         return channel
 
 class MotecLog(MotecBase):
@@ -262,19 +495,152 @@ class MotecLog(MotecBase):
         self.serial = getattr(self, "serial", 12007)
         self.pad23 = getattr(self, "pad23", b"2208d200")
 
+        # where the channels spill their samples to, if anywhere
+        self.spilldir = None
+        self.spill_samples = 0
+
+        # channels by name and short name
+        self.index = {}
+        for channel in self.channels:
+            self.index_channel(channel)
+
+    def index_channel(self, channel):
+        self.index.setdefault(channel.shortname, channel)
+        self.index[channel.name] = channel
+
     def add_channel(self, channel):
         if not isinstance(channel, MotecChannel):
             channel = MotecChannel(channel)
         self.channels.append(channel)
         self.numchannels = len(self.channels)
+        self.index_channel(channel)
+
+    def channel(self, name):
+        """
+        the channel with that name or short name
+        """
+        try:
+            return self.index[name]
+        except KeyError:
+            raise KeyError(f"no channel {name} in the log") from None
+
+    def slice(self, t0 = 0.0, t1 = None, channels = None):
+        """
+        the samples from t0 up to t1 seconds of the channels, all of them by
+        default, as a dict of float64 numpy arrays by channel name. Only that
+        range of each channel is read from a log read with open
+        """
+        if channels is None:
+            channels = self.channels
+        else:
+            channels = [self.channel(name) for name in channels]
+
+        samples = {}
+        for channel in channels:
+            # the beacon times of the .ldx are rounded, so the closest sample
+            start = max(round(t0 * channel.freq), 0)
+            stop = None if t1 is None else max(round(t1 * channel.freq), start)
+            samples[channel.name] = channel.read(start, stop)
+        return samples
+
+    def lap_times(self, n, logx = None):
+        """
+        start and end of lap n in seconds from the beacons of the MotecLogExtra
+        of the log, the out lap is lap 1 and the in lap ends with the log.
+        A log read with open has the laps of its .ldx
+        """
+        logx = logx or getattr(self, "logx", None)
+        if logx is None:
+            raise ValueError("the laps of the log are needed, from its .ldx")
+
+        beacons = [0.0] + [elapsed / 1000000 for _, elapsed in logx.get_beacons()]
+        if not 1 <= n <= len(beacons):
+            raise IndexError(f"no lap {n} in the log, {len(beacons)} laps")
+        return beacons[n - 1], beacons[n] if n < len(beacons) else None
+
+    def lap(self, n, logx = None, channels = None):
+        """
+        the samples of lap n of the channels, like slice
+        """
+        return self.slice(*self.lap_times(n, logx), channels=channels)
 
     def add_samples(self, samples):
         for (idx, sample) in enumerate(samples):
             self.channels[idx].add_sample(sample)
 
+        if self.spill_samples and self.channels[0].pending >= self.spill_samples:
+            self.flush()
+
+    def add_columns(self, columns):
+        # one list or numpy array of samples per channel
+        for (idx, samples) in enumerate(columns):
+            self.channels[idx].add_samples(samples)
+
+        if self.spill_samples and self.channels and self.channels[0].pending >= self.spill_samples:
+            self.flush()
+
+    def spill(self, directory=None, samples=SPILL_SAMPLES):
+        """
+        keep at most about `samples` samples per channel in memory, the rest
+        are encoded into one spill file per channel in a temporary directory
+        under directory, add the channels first
+        """
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.spilldir = tempfile.mkdtemp(prefix="ld-", dir=directory)
+        self.spill_samples = samples
+        for (idx, channel) in enumerate(self.channels):
+            channel.samples.spill(os.path.join(self.spilldir, f"{idx}.spill"))
+
+    def flush(self):
+        for channel in self.channels:
+            channel.samples.flush()
+
+    def close(self):
+        """
+        remove the spill files, or let go of the file of a log read with open
+        """
+        for channel in self.channels:
+            channel.close()
+        if self.spilldir:
+            shutil.rmtree(self.spilldir, ignore_errors=True)
+            self.spilldir = None
+            self.spill_samples = 0
+        if getattr(self, "mm", None):
+            self.mm.close()
+            self.mm = None
+
+    def memory_usage(self):
+        """
+        bytes held by the samples of each channel, by channel name
+        """
+        return {channel.name: channel.samples.nbytes for channel in self.channels}
+
 
     @classmethod
-    def from_string(cls, data, pad = False):
+    def open(cls, filename):
+        """
+        read a .ld file through a memory map, only the headers are read up
+        front and the samples of each channel when they are used
+        """
+        with open(filename, "rb") as fp:
+            mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        log = cls.from_string(mm, lazy=True)
+        log.mm = mm
+
+        # the laps, when the .ldx is there
+        if os.path.exists(f"{filename}x"):
+            log.logx = MotecLogExtra.open(f"{filename}x")
+        return log
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def from_string(cls, data, pad = False, lazy = False):
         # the log has to start from zero
         log = super().from_string(data, pad=pad)
 
@@ -286,7 +652,7 @@ class MotecLog(MotecBase):
         channelpos = log.firstchannelpos
 
         while channelpos:
-            channel = MotecChannel.from_string(data, start = channelpos, pad=pad)
+            channel = MotecChannel.from_string(data, start = channelpos, pad=pad, lazy=lazy)
             log.add_channel(channel)
             channelpos = channel.nextpos
 
@@ -295,16 +661,23 @@ class MotecLog(MotecBase):
     def to_string(self):
 
         data = BytesIO()
+        self.write(data)
+        return data.getbuffer()
+
+    def write(self, f):
+        """
+        write the log to a file object, the pointers are worked out from the
+        number of samples up front so every part is written in order and
+        the samples of one channel at a time
+        """
 
-        # pack the event
+        # place the event
         eventpos = 0
         nextpos = self.header.size
         if getattr(self, "event", None):
             eventpos = nextpos
             nextpos = nextpos + self.event.header.size
-            data.seek(eventpos)
-            data.write(self.event.to_string())
-            
+
         self.eventpos = eventpos
 
         # work out the channel pointers
@@ -330,20 +703,17 @@ class MotecLog(MotecBase):
 
                 ci.prevpos = prevpos
                 ci.datapos = datapos
-                data.seek(thispos)
-                data.write(ci.to_string())
-
-                # get the samples for the channel
-                samples = ci.samples.to_string()
-                data.seek(datapos)
-                data.write(samples)
-                
+
                 # finally, update all the pointers
-                datapos += len(samples)
+                datapos += ci.samples.numsamples * ci.samples.datasize
                 prevpos = thispos
                 thispos = ci.nextpos
 
-        # now pack the log header
-        data.seek(0)
-        data.write(super().to_string())
-        return data.getbuffer()
\ No newline at end of file
+        # now pack the log header, the event, the channel headers and the samples
+        f.write(super().to_string())
+        if eventpos:
+            f.write(self.event.to_string())
+        for ci in self.channels:
+            f.write(ci.to_string())
+        for ci in self.channels:
+            ci.samples.write(f)
\ No newline at end of file
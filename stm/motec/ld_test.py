@@ -0,0 +1,66 @@
+import random
+import struct
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from stm.motec import ld
+from stm.motec.ld import MotecSamples
+
+
+def make_samples(datatype, datasize, values, multiplier=1, shift=0, scale=1, decplaces=0):
+    channel = SimpleNamespace(datatype=datatype, datasize=datasize, multiplier=multiplier,
+                              shift=shift, scale=scale, decplaces=decplaces)
+    return MotecSamples(channel=channel, samples=values)
+
+
+def packed(samples):
+    # the struct loop, without numpy
+    with mock.patch.object(ld, "np", None):
+        return samples.pack()
+
+
+@unittest.skipIf(ld.np is None, "numpy is not installed")
+class MotecSamplesEncodeTest(unittest.TestCase):
+
+    def test_ints(self):
+        rand = random.Random(1)
+        for datasize, limit in ((1, 2 ** 7), (2, 2 ** 15), (4, 2 ** 31)):
+            values = [rand.randrange(-limit, limit) for _ in range(500)]
+            samples = make_samples(0x0003, datasize, values)
+            self.assertEqual(samples.encode(), packed(samples), datasize)
+
+    def test_scaled(self):
+        rand = random.Random(2)
+        values = [rand.uniform(-300, 300) for _ in range(500)] + [0.0, -0.0, 0.5, -0.5, 299.99]
+        for datatype, datasize in ((0x0000, 2), (0x0005, 4), (0x0007, 2), (0x0007, 4)):
+            samples = make_samples(datatype, datasize, values, multiplier=3, shift=-2, scale=5, decplaces=1)
+            self.assertEqual(samples.encode(), packed(samples), (datatype, datasize))
+
+    def test_widened(self):
+        # an int channel that got a float and was switched to doubles
+        samples = make_samples(0x0003, 4, [1, 2, 3.75, -4.25, 5])
+        self.assertEqual(samples.samples.typecode, "d")
+        self.assertEqual(samples.encode(), packed(samples))
+
+    def test_overflow(self):
+        # left to the loop, which raises or packs them the same
+        for datatype, datasize, values in ((0x0003, 1, [1, 200]),
+                                           (0x0003, 2, [-40000]),
+                                           (0x0003, 4, [2 ** 40]),
+                                           (0x0003, 4, [1.0, float("nan")]),
+                                           (0x0007, 2, [1e6]),
+                                           (0x0007, 4, [1e300])):
+            samples = make_samples(datatype, datasize, values)
+            self.assertIsNone(samples.encode(), values)
+            try:
+                expected = packed(samples)
+            except (struct.error, OverflowError, ValueError) as e:
+                with self.assertRaises(type(e)):
+                    samples.pack()
+            else:
+                self.assertEqual(samples.pack(), expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
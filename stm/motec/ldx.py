@@ -1,9 +1,16 @@
-from xml.dom import minidom
+from io import StringIO, BytesIO
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape
+
+# escaped in the attribute values on top of &, < and >
+ATTR_ENTITIES = {'"': "&quot;"}
 
 class MotecLogExtra:
     
     def __init__(self):
         self.laps = []
+        # the strings of the details of a parsed ldx, by id
+        self.details = {}
 
     def valid_laps(self):
         return len(self.laps) >= 2
@@ -44,46 +51,38 @@ class MotecLogExtra:
 
 
     def to_string(self):
+        data = StringIO()
+        self.write(data)
+        return data.getvalue()
+
+    def write(self, f):
+        """
+        write the ldx to a text file object line by line, the same text
+        minidom's toprettyxml gives for the document
+        """
+        f.write('<?xml version="1.0" ?>\n')
+        f.write(f'<LDXFile{attrs(locale="English_United Kingdom.1252", DefaultLocale="C", Version="1.6")}>\n')
+        f.write('  <Layers>\n')
+        f.write('    <Layer>\n')
+        f.write('      <MarkerBlock>\n')
+
+        group = attrs(Name="Beacons", Index=str(len(self.laps) - 1)) # number of beacons 0 index
+        beacons = self.get_beacons()
+        if beacons:
+            f.write(f'        <MarkerGroup{group}>\n')
+            for (lapnum, elapsedtime) in beacons:
+                marker = attrs(Version="100", ClassName="BCN", Name=f"Manual.{lapnum}",
+                               Flags="77", Time=f"{elapsedtime:0.2f}")
+                f.write(f'          <Marker{marker}/>\n')
+            f.write('        </MarkerGroup>\n')
+        else:
+            f.write(f'        <MarkerGroup{group}/>\n')
 
-        root = minidom.Document()
-
-        ldx = root.createElement("LDXFile")
-        root.appendChild(ldx)
-
-        ldx.setAttribute("locale", "English_United Kingdom.1252")
-        ldx.setAttribute("DefaultLocale", "C")
-        ldx.setAttribute("Version", "1.6")
-
-        layers = root.createElement("Layers")
-        ldx.appendChild(layers)
-
-        layer = root.createElement("Layer")
-        layers.appendChild(layer)
-
-        markerblock = root.createElement("MarkerBlock")
-        layer.appendChild(markerblock)
-
-        markergroup = root.createElement("MarkerGroup")
-        markerblock.appendChild(markergroup)
-        markergroup.setAttribute("Name", "Beacons")
-        markergroup.setAttribute("Index", str(len(self.laps) - 1)) # number of beacons 0 index
-
-        for (lapnum, elapsedtime) in self.get_beacons():
-            marker = root.createElement("Marker")
-            marker.setAttribute("Version", "100")
-            marker.setAttribute("ClassName", "BCN")
-            marker.setAttribute("Name", f"Manual.{lapnum}")
-            marker.setAttribute("Flags", "77")
-            marker.setAttribute("Time", f"{elapsedtime:0.2f}")
-            markergroup.appendChild(marker)
-
-        details = root.createElement("Details")
-        layers.appendChild(details)
+        f.write('      </MarkerBlock>\n')
+        f.write('    </Layer>\n')
+        f.write('    <Details>\n')
 
-        totallaps = root.createElement("String")
-        details.appendChild(totallaps)
-        totallaps.setAttribute("Id", "Total Laps")
-        totallaps.setAttribute("Value", str(len(self.laps) + 1)) # include the in-lap
+        f.write(f'      <String{attrs(Id="Total Laps", Value=str(len(self.laps) + 1))}/>\n') # include the in-lap
 
         fastestlap, fastesttime = self.get_fastest_lap()
         if fastesttime:
@@ -91,14 +90,49 @@ class MotecLogExtra:
             seconds = fastesttime % 3600 % 60
             fastesttime = f"{minutes:02d}:{seconds:06.3f}"
 
-            ft = root.createElement("String")
-            details.appendChild(ft)
-            ft.setAttribute("Id", "Fastest Time")
-            ft.setAttribute("Value", fastesttime)
+            f.write(f'      <String{attrs(Id="Fastest Time", Value=fastesttime)}/>\n')
+            f.write(f'      <String{attrs(Id="Fastest Lap", Value=str(fastestlap))}/>\n')
+
+        f.write('    </Details>\n')
+        f.write('  </Layers>\n')
+        f.write('</LDXFile>\n')
+
+    @classmethod
+    def from_string(cls, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return cls.read(BytesIO(data))
+
+    @classmethod
+    def open(cls, filename):
+        with open(filename, "rb") as f:
+            return cls.read(f)
+
+    @classmethod
+    def read(cls, f):
+        """
+        parse an ldx file object, the laps are rebuilt from the beacons and
+        the strings of the details, e.g. the fastest lap, go into details
+        """
+        logx = cls()
+        beacons = []
+
+        for _, elem in iterparse(f):
+            if elem.tag == "Marker" and elem.get("ClassName") == "BCN":
+                beacons.append(float(elem.get("Time")))
+            elif elem.tag == "String" and elem.get("Id"):
+                logx.details[elem.get("Id")] = elem.get("Value")
+            elem.clear()
+
+        elapsedtime = 0.0
+        for beacon in sorted(beacons):
+            # the beacons are written to 1/100 of a micro second
+            logx.laps.append(round((beacon - elapsedtime) / 1000000, 8))
+            elapsedtime = beacon
+
+        return logx
 
-            fl = root.createElement("String")
-            details.appendChild(fl)
-            fl.setAttribute("Id", "Fastest Lap")
-            fl.setAttribute("Value", str(fastestlap))
 
-        return(root.toprettyxml(indent="  "))
\ No newline at end of file
+def attrs(**values):
+    # quoted like minidom does
+    return "".join(f' {k}="{escape(v, ATTR_ENTITIES)}"' for (k, v) in values.items())
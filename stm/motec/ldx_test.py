@@ -0,0 +1,72 @@
+import random
+import unittest
+from xml.dom import minidom
+
+from stm.motec.ldx import MotecLogExtra
+
+
+def minidom_ldx(logx):
+    # the document as it was built with minidom before write streamed it
+    root = minidom.Document()
+
+    def element(parent, name, **values):
+        elem = root.createElement(name)
+        parent.appendChild(elem)
+        for k, v in values.items():
+            elem.setAttribute(k, v)
+        return elem
+
+    ldx = element(root, "LDXFile", locale="English_United Kingdom.1252", DefaultLocale="C", Version="1.6")
+    layers = element(ldx, "Layers")
+    layer = element(layers, "Layer")
+    markerblock = element(layer, "MarkerBlock")
+    markergroup = element(markerblock, "MarkerGroup", Name="Beacons", Index=str(len(logx.laps) - 1))
+    for (lapnum, elapsedtime) in logx.get_beacons():
+        element(markergroup, "Marker", Version="100", ClassName="BCN", Name=f"Manual.{lapnum}",
+                Flags="77", Time=f"{elapsedtime:0.2f}")
+
+    details = element(layers, "Details")
+    element(details, "String", Id="Total Laps", Value=str(len(logx.laps) + 1))
+
+    fastestlap, fastesttime = logx.get_fastest_lap()
+    if fastesttime:
+        minutes = int(fastesttime % 3600 // 60)
+        seconds = fastesttime % 3600 % 60
+        element(details, "String", Id="Fastest Time", Value=f"{minutes:02d}:{seconds:06.3f}")
+        element(details, "String", Id="Fastest Lap", Value=str(fastestlap))
+
+    return root.toprettyxml(indent="  ")
+
+
+class MotecLogExtraTest(unittest.TestCase):
+
+    def laps(self):
+        rand = random.Random(3)
+        for count in (0, 1, 2, 3, 5, 50, 300):
+            for _ in range(3):
+                laps = [round(rand.uniform(0, 200), 3) for _ in range(count)]
+                if laps and rand.random() < 0.3:
+                    # a lap that was never timed
+                    laps[-1] = 0.0
+                yield laps
+        # past an hour
+        yield [3725.5, 4000.125]
+
+    def test_same_as_minidom(self):
+        for laps in self.laps():
+            logx = MotecLogExtra()
+            logx.laps = laps
+            self.assertEqual(logx.to_string(), minidom_ldx(logx), laps)
+
+    def test_round_trip(self):
+        for laps in self.laps():
+            logx = MotecLogExtra()
+            logx.laps = laps
+            data = logx.to_string()
+            parsed = MotecLogExtra.from_string(data)
+            self.assertEqual(parsed.to_string(), data, laps)
+            self.assertEqual(parsed.details["Total Laps"], str(len(laps) + 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,499 @@
+from .rawwriter import RawWriter, expand_run, read_samples
+from bisect import bisect_right
+from array import array
+import lzma
+import mmap
+import os
+import sqlite3
+import struct
+import zlib
+from logging import getLogger
+l = getLogger(__name__)
+
+# Append only raw capture, an alternative to the sqlite3 db
+#
+#   header  magic, freq (0 when unknown)
+#   frames  length, timestamp, tick, payload of `length` bytes
+#
+# a frame of length 0 repeats the previous payload like a NULL row in the db,
+# and a frame with the REPEATS bit set in its length holds a run of repeats
+# instead of a payload: the number of repeats and the last timestamp.
+# The sidecar index holds (tick, offset) of every INDEX_EVERY frames or so,
+# always pointing at a frame with a payload, and is flushed with the frames.
+RAW_EXTENSION = ".raw"
+INDEX_EXTENSION = ".idx"
+MAGIC = b"STMRAW\x00\x01"
+HEADER = struct.Struct("<8sI")
+FRAME = struct.Struct("<Idi")
+REPEATS = 0x80000000
+RUN = struct.Struct("<Id")
+INDEX = struct.Struct("<iQ")
+INDEX_EVERY = 64
+NO_TICK = -1
+
+# Compressed variant, the packets are stored decrypted in chunks of a few
+# seconds, XOR-delta against the previous packet and then compressed
+#
+#   header  magic, freq, codec
+#   chunks  compressed length, entries, tick of the first packet, body
+#
+# the body holds the first and last timestamps (f8), the counts (u4) and the
+# lengths (u4) of the entries followed by the deltas of their packets. An
+# entry is one packet repeated count times, a length of 0 repeats the packet
+# of the previous entry. A packet that could not be decrypted is stored as
+# captured, outside of the XOR-delta chain, with the UNDECRYPTED bit set in
+# its length. Each chunk decodes on its own, and with a chunk every few
+# seconds the chunk headers are the index.
+CHUNKED_EXTENSION = ".rawz"
+CHUNKED_MAGIC = b"STMRAWZ\x01"
+CHUNKED_HEADER = struct.Struct("<8sIB3x")
+CHUNK = struct.Struct("<IIi")
+CHUNK_SECONDS = 5.0
+UNDECRYPTED = 0x80000000
+CODECS = {
+    "zlib": (0, zlib.compress, zlib.decompress),
+    "lzma": (1, lzma.compress, lzma.decompress),
+}
+
+
+def is_rawfile(filename):
+    return str(filename).endswith(RAW_EXTENSION)
+
+
+def is_chunked(filename):
+    return str(filename).endswith(CHUNKED_EXTENSION)
+
+
+def xor_delta(packets):
+    """
+    XOR every packet with the previous one when they have the same size,
+    the fields that did not change become runs of zeros
+    """
+    deltas = []
+    prev, prev_size = 0, -1
+    for packet in packets:
+        value = int.from_bytes(packet, "little")
+        size = len(packet)
+        if size == prev_size:
+            deltas.append((value ^ prev).to_bytes(size, "little"))
+        else:
+            deltas.append(bytes(packet))
+        prev, prev_size = value, size
+    return deltas
+
+
+def xor_undelta(deltas):
+    packets = []
+    prev, prev_size = 0, -1
+    for delta in deltas:
+        value = int.from_bytes(delta, "little")
+        size = len(delta)
+        if size == prev_size:
+            value ^= prev
+            packets.append(value.to_bytes(size, "little"))
+        else:
+            packets.append(bytes(delta))
+        prev, prev_size = value, size
+    return packets
+
+
+class RawFileWriter(RawWriter):
+
+    """
+    RawWriter for the append only format
+
+    tick is called with each new payload and returns the tick to index it
+    by, or NO_TICK.
+    """
+
+    def __init__(self, rawfile, freq=None, tick=None, rows=1000, interval=1.0):
+        super().__init__(rawfile, freq=freq, rows=rows, interval=interval)
+        self.tick = tick
+        self.last_tick = NO_TICK
+        self.offset = 0
+        self.unindexed = INDEX_EVERY
+
+    def open(self):
+        self.fp = open(self.rawfile, "xb")
+        self.idx = open(self.rawfile + INDEX_EXTENSION, "wb")
+        self.fp.write(HEADER.pack(MAGIC, int(self.freq or 0)))
+        self.offset = HEADER.size
+
+    def write(self, records):
+        frames = []
+        index = []
+        for timestamp, data, count, last in records:
+            if data is None:
+                payload = RUN.pack(count, last)
+                tick = self.last_tick
+                frames.append(FRAME.pack(REPEATS | len(payload), timestamp, tick))
+                frames.append(payload)
+                self.offset += FRAME.size + len(payload)
+                continue
+            else:
+                payload = data
+                tick = self.tick(data) if self.tick else NO_TICK
+                self.last_tick = tick
+
+                if self.unindexed >= INDEX_EVERY:
+                    index.append(INDEX.pack(tick, self.offset))
+                    self.unindexed = 0
+
+            frames.append(FRAME.pack(len(payload), timestamp, tick))
+            frames.append(payload)
+            self.offset += FRAME.size + len(payload)
+            self.unindexed += 1
+
+        self.fp.write(b"".join(frames))
+        self.fp.flush()
+        if index:
+            self.idx.write(b"".join(index))
+            self.idx.flush()
+
+    def close(self):
+        self.fp.close()
+        self.idx.close()
+
+
+def map_rawfile(rawfile, header):
+    """
+    mmap a capture, which must at least hold its header
+    """
+    with open(rawfile, "rb") as fp:
+        # an empty file can't be mapped at all
+        if os.fstat(fp.fileno()).st_size < header.size:
+            raise ValueError(f"{rawfile} is too short to be a raw capture, the header is missing")
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class RawFile:
+
+    """
+    mmap reader of the append only format
+
+    Iterating gives (timestamp, data) with the repeats filled in, like the
+    rows of the db. samples(tick) starts the replay at a tick through the
+    index instead of reading everything before it.
+    """
+
+    def __init__(self, rawfile):
+        self.rawfile = rawfile
+        self.mm = map_rawfile(rawfile, HEADER)
+
+        magic, freq = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"{rawfile} is not a raw capture")
+        self.freq = freq or None
+
+        # a capture that was cut short may be indexed past its last full frame
+        self.ticks = []
+        self.offsets = []
+        try:
+            with open(rawfile + INDEX_EXTENSION, "rb") as fp:
+                index = fp.read()
+            for tick, offset in INDEX.iter_unpack(index[:len(index) - len(index) % INDEX.size]):
+                if offset < len(self.mm):
+                    self.ticks.append(tick)
+                    self.offsets.append(offset)
+        except FileNotFoundError:
+            pass
+
+    def __iter__(self):
+        for _, timestamp, _, data in self.frames():
+            yield timestamp, data
+
+    def frames(self, offset=HEADER.size):
+        """
+        yield (offset, timestamp, tick, data) of every sample from offset,
+        which must be a frame with a payload, with the repeats expanded
+        """
+        mm = self.mm
+        size = len(mm)
+        data = None
+        while offset + FRAME.size <= size:
+            length, timestamp, tick = FRAME.unpack_from(mm, offset)
+            start = offset + FRAME.size
+            repeats = length & REPEATS
+            length &= ~REPEATS
+            if start + length > size:
+                # the last frame was not completely written
+                break
+
+            if repeats:
+                count, last = RUN.unpack_from(mm, start)
+                for timestamp, _ in expand_run(timestamp, last, count, None):
+                    yield offset, timestamp, tick, data
+            else:
+                if length:
+                    data = mm[start:start + length]
+                yield offset, timestamp, tick, data
+            offset = start + length
+
+    def seek(self, tick):
+        """
+        offset of the indexed frame to start reading from to reach tick,
+        the ticks only go up within a capture
+        """
+        i = bisect_right(self.ticks, tick) - 1
+        return self.offsets[i] if i >= 0 else HEADER.size
+
+    def samples(self, tick=None):
+        """
+        yield (timestamp, data) starting from the first frame at or after tick
+        """
+        offset = HEADER.size if tick is None else self.seek(tick)
+        for _, timestamp, frame_tick, data in self.frames(offset):
+            if tick is not None and frame_tick < tick:
+                continue
+            tick = None
+            yield timestamp, data
+
+    def close(self):
+        self.mm.close()
+
+
+class ChunkedRawWriter(RawWriter):
+
+    """
+    RawWriter for the compressed format
+
+    decrypt is called with the list of packets of a chunk and returns them
+    decrypted, tick is called with the packets of every chunk until one has a
+    tick.
+    """
+
+    def __init__(self, rawfile, freq=None, tick=None, decrypt=None, codec="zlib",
+                 seconds=CHUNK_SECONDS, rows=1000, interval=1.0):
+        super().__init__(rawfile, freq=freq, rows=rows, interval=interval)
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec {codec}, expected one of {tuple(CODECS)}")
+        self.tick = tick
+        self.decrypt = decrypt
+        self.codec = codec
+        self.seconds = seconds
+        self.chunk = []
+        self.last_data = None
+        self.offset = 0
+        self.size = 0
+
+    def open(self):
+        self.fp = open(self.rawfile, "xb")
+        self.fp.write(CHUNKED_HEADER.pack(CHUNKED_MAGIC, int(self.freq or 0), CODECS[self.codec][0]))
+        self.offset = CHUNKED_HEADER.size
+
+    def write(self, records):
+        chunk = self.chunk
+        for timestamp, data, count, last in records:
+            if data is None and not chunk:
+                # every chunk starts with a packet
+                data = self.last_data
+            elif data is not None:
+                self.last_data = data
+            chunk.append((timestamp, data, count, last))
+
+            if last - chunk[0][0] >= self.seconds:
+                self.write_chunk()
+                chunk = self.chunk
+
+    def write_chunk(self):
+        chunk = self.chunk
+        self.chunk = []
+
+        captured = [data for _, data, _, _ in chunk if data is not None]
+
+        # the tick of the first packet with one, for the index
+        tick = NO_TICK
+        if self.tick:
+            for packet in captured:
+                tick = self.tick(packet)
+                if tick != NO_TICK:
+                    break
+
+        # an empty packet back from decrypt is a bad magic number
+        decrypted = self.decrypt(captured) if self.decrypt else captured
+
+        lengths = []
+        payloads = []
+        packets = iter(zip(captured, decrypted))
+        for _, data, count, _ in chunk:
+            if data is None:
+                lengths.append(0)
+            else:
+                original, packet = next(packets)
+                if packet:
+                    lengths.append(len(packet))
+                    payloads.append((True, packet))
+                else:
+                    # kept as captured, out of the XOR chain
+                    packet = original
+                    lengths.append(UNDECRYPTED | len(packet))
+                    payloads.append((False, packet))
+            self.size += count * len(packet)
+
+        # only the decrypted packets are XORed with each other
+        deltas = iter(xor_delta([packet for delta, packet in payloads if delta]))
+        payloads = [next(deltas) if delta else packet for delta, packet in payloads]
+
+        body = b"".join([array("d", [entry[0] for entry in chunk]).tobytes(),
+                         array("d", [entry[3] for entry in chunk]).tobytes(),
+                         array("I", [entry[2] for entry in chunk]).tobytes(),
+                         array("I", lengths).tobytes(),
+                         *payloads])
+        body = CODECS[self.codec][1](body)
+
+        self.fp.write(CHUNK.pack(len(body), len(chunk), tick))
+        self.fp.write(body)
+        self.fp.flush()
+        self.offset += CHUNK.size + len(body)
+
+    def close(self):
+        if self.chunk:
+            self.write_chunk()
+        self.fp.close()
+
+        if self.offset > CHUNKED_HEADER.size:
+            l.info(f"RAW: {self.size} bytes comprimidos para {self.offset} bytes"
+                   f" ({self.size / self.offset:.1f}x)")
+
+
+class ChunkedRawFile(RawFile):
+
+    """
+    mmap reader of the compressed format
+
+    The chunks are only decompressed as they are reached, samples(tick)
+    starts at the chunk holding tick.
+    """
+
+    def __init__(self, rawfile):
+        self.rawfile = rawfile
+        self.mm = map_rawfile(rawfile, CHUNKED_HEADER)
+
+        magic, freq, codec = CHUNKED_HEADER.unpack_from(self.mm)
+        if magic != CHUNKED_MAGIC:
+            self.mm.close()
+            raise ValueError(f"{rawfile} is not a compressed raw capture")
+        self.freq = freq or None
+        self.decompress = {c[0]: c[2] for c in CODECS.values()}[codec]
+
+        self.ticks = []
+        self.offsets = []
+        for tick, offset in self.chunks(decode=False):
+            self.ticks.append(tick)
+            self.offsets.append(offset)
+
+    def chunks(self, offset=CHUNKED_HEADER.size, decode=True):
+        """
+        yield the decoded (timestamp, packet, count, last) entries of every
+        chunk from offset, or just (tick, offset) without decoding
+        """
+        mm = self.mm
+        size = len(mm)
+        while offset + CHUNK.size <= size:
+            length, count, tick = CHUNK.unpack_from(mm, offset)
+            start = offset + CHUNK.size
+            if start + length > size:
+                # the last chunk was not completely written
+                break
+
+            if not decode:
+                yield tick, offset
+            else:
+                body = self.decompress(mm[start:start + length])
+                timestamps = array("d", body[:8 * count])
+                lasts = array("d", body[8 * count:16 * count])
+                counts = array("I", body[16 * count:20 * count])
+                lengths = array("I", body[20 * count:24 * count])
+                payloads = []
+                pos = 24 * count
+                for n in lengths:
+                    end = pos + (n & ~UNDECRYPTED)
+                    if n:
+                        payloads.append(body[pos:end])
+                        pos = end
+                    else:
+                        payloads.append(None)
+
+                # undo the XOR chain of the decrypted packets only
+                deltas = [payload for n, payload in zip(lengths, payloads) if n and not n & UNDECRYPTED]
+                packets = iter(xor_undelta(deltas))
+
+                entries = []
+                packet = None
+                for timestamp, last, repeats, n, payload in zip(timestamps, lasts, counts, lengths, payloads):
+                    if n & UNDECRYPTED:
+                        packet = bytes(payload)
+                    elif n:
+                        packet = next(packets)
+                    elif packet is None:
+                        raise ValueError(f"{self.rawfile}: chunk starting with a repeat")
+                    entries.append((timestamp, packet, repeats, last))
+                yield entries
+
+            offset = start + length
+
+    def frames(self, offset=CHUNKED_HEADER.size):
+        for entries in self.chunks(offset):
+            for first, packet, count, last in entries:
+                for timestamp, _ in expand_run(first, last, count, None):
+                    yield offset, timestamp, NO_TICK, packet
+
+    def seek(self, tick):
+        i = bisect_right(self.ticks, tick) - 1
+        return self.offsets[i] if i >= 0 else CHUNKED_HEADER.size
+
+    def samples(self, tick=None):
+        offset = CHUNKED_HEADER.size if tick is None else self.seek(tick)
+        for _, timestamp, _, data in self.frames(offset):
+            yield timestamp, data
+
+
+def convert_db(dbfile, rawfile, tick=None, decrypt=None, codec="zlib"):
+    """
+    copy a sqlite3 raw db into the append only or the compressed format,
+    picked by the extension of rawfile, returns the number of samples
+    """
+    con = sqlite3.connect(dbfile)
+    (freq, ) = con.execute("SELECT value FROM settings WHERE name='freq'").fetchone()
+
+    if is_chunked(rawfile):
+        writer = ChunkedRawWriter(rawfile, freq=freq, tick=tick, decrypt=decrypt, codec=codec)
+    else:
+        writer = RawFileWriter(rawfile, freq=freq, tick=tick)
+    writer.open()
+
+    # back to NULL rows for the repeats, so they are collapsed into runs
+    rows = []
+    last_data = None
+    for timestamp, data in read_samples(con):
+        rows.append((timestamp, None if data == last_data else data))
+        last_data = data
+        if len(rows) >= 1000:
+            writer.commit(rows)
+            rows = []
+    writer.commit(rows, final=True)
+
+    writer.close()
+    con.close()
+    return writer.rows
+
+
+if __name__ == "__main__":
+    # convert the sqlite3 raw dbs of the GT7
+    #   python -m stm.rawfile [--compress [--codec lzma]] capture.db [capture.db ...]
+    import argparse
+    from stm.gt7.packet import packet_tick, decrypt_packets
+
+    parser = argparse.ArgumentParser(description="Converter os bancos RAW em arquivos .raw")
+    parser.add_argument("dbfile", nargs="+")
+    parser.add_argument("--compress", action="store_true",
+                        help="Salvar os pacotes descriptografados e comprimidos (.rawz)")
+    parser.add_argument("--codec", choices=tuple(CODECS), default="zlib")
+    args = parser.parse_args()
+
+    for dbfile in args.dbfile:
+        extension = CHUNKED_EXTENSION if args.compress else RAW_EXTENSION
+        rawfile = os.path.splitext(dbfile)[0] + extension
+        count = convert_db(dbfile, rawfile, tick=packet_tick, decrypt=decrypt_packets, codec=args.codec)
+        print(f"{dbfile} -> {rawfile}: {count} pacotes, {os.path.getsize(rawfile)} bytes")
@@ -0,0 +1,85 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from stm.rawfile import ChunkedRawWriter, ChunkedRawFile, RawFile
+from stm.gt7.packet import GT7DataPacket, Salsa20_xor, decrypt_packets, packet_tick
+
+
+def encrypt(plain, iv1):
+    # the nonce is taken from the encrypted packet, so it goes in after
+    nonce = (iv1 ^ 0xDEADBEAF).to_bytes(4, "little") + iv1.to_bytes(4, "little")
+    packet = bytearray(Salsa20_xor(bytes(plain), nonce, GT7DataPacket.key))
+    packet[0x40:0x44] = iv1.to_bytes(4, "little")
+    return bytes(packet)
+
+
+def make_packet(tick):
+    plain = bytearray(GT7DataPacket.size)
+    struct.pack_into("<I", plain, 0, GT7DataPacket.magic)
+    struct.pack_into("<i", plain, 0x70, tick)
+    struct.pack_into("<f", plain, 0x3C, tick / 10)
+    return encrypt(plain, tick * 7919)
+
+
+class ChunkedRawTest(unittest.TestCase):
+
+    def write(self, records):
+        rawfile = os.path.join(self.tmpdir.name, "test.rawz")
+        writer = ChunkedRawWriter(rawfile, freq=60, tick=packet_tick,
+                                  decrypt=decrypt_packets, seconds=1.0)
+        writer.open()
+        writer.write(records)
+        writer.close()
+        return ChunkedRawFile(rawfile)
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bad_packets(self):
+        packets = [make_packet(tick) for tick in range(60)]
+        # bad magic numbers in a chunk and first in the next one
+        packets[5] = bytes(GT7DataPacket.size)
+        packets[31] = os.urandom(GT7DataPacket.size)
+
+        records = []
+        for i, packet in enumerate(packets):
+            records.append((i / 30, packet, 1, i / 30))
+            if i in (5, 10):
+                # repeats of a bad and of a good packet
+                records.append((i / 30 + 0.01, None, 2, i / 30 + 0.02))
+
+        expected = []
+        for timestamp, packet, count, _ in records:
+            if packet is not None:
+                decrypted = bytes(GT7DataPacket.decrypt(packet))
+                last = decrypted or packet
+            expected.extend([last] * count)
+
+        rawfile = self.write(records)
+        try:
+            samples = [data for _, data in rawfile.samples()]
+            self.assertEqual(len(samples), len(expected))
+            for i, (sample, packet) in enumerate(zip(samples, expected)):
+                self.assertEqual(sample, packet, f"sample {i}")
+            self.assertEqual(len(rawfile.ticks), 2)
+            self.assertEqual(rawfile.ticks[1], 32)
+        finally:
+            rawfile.close()
+
+    def test_short_files(self):
+        for name, cls, content in (("empty.raw", RawFile, b""),
+                                   ("short.rawz", ChunkedRawFile, b"STMRAWZ")):
+            rawfile = os.path.join(self.tmpdir.name, name)
+            with open(rawfile, "wb") as fp:
+                fp.write(content)
+            with self.assertRaisesRegex(ValueError, "too short"):
+                cls(rawfile)
+
+
+if __name__ == "__main__":
+    unittest.main()
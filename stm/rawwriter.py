@@ -0,0 +1,208 @@
+from threading import Thread
+from queue import SimpleQueue, Empty
+import os
+import sqlite3
+import time
+from logging import getLogger
+l = getLogger(__name__)
+
+
+def expand_run(first, last, count, data):
+    """
+    yield the (timestamp, data) of a run of count repeated samples, with the
+    timestamps spread evenly between the first and the last one
+    """
+    if count <= 1:
+        yield first, data
+        return
+    step = (last - first) / (count - 1)
+    for i in range(count):
+        yield first + i * step, data
+
+
+def iter_rows(res, size=1000):
+    while True:
+        rows = res.fetchmany(size)
+        if not rows:
+            return
+        yield from rows
+
+
+def read_samples(con):
+    """
+    yield the (timestamp, data) of every sample of a raw db, ordered by
+    timestamp and with the repeats filled in
+    """
+    try:
+        res = con.execute("SELECT timestamp, data, repeats, last FROM samples ORDER BY timestamp")
+    except sqlite3.OperationalError:
+        # captured before the runs of repeats were collapsed
+        res = con.execute("SELECT timestamp, data, NULL, NULL FROM samples ORDER BY timestamp")
+
+    last_data = None
+
+    for timestamp, data, repeats, last in iter_rows(res):
+        if isinstance(timestamp, int):
+            timestamp = timestamp / 1000.0
+
+        if data is None:
+            # repeat the last changed sample
+            if repeats:
+                yield from expand_run(timestamp, last, repeats, last_data)
+                continue
+            data = last_data
+        else:
+            last_data = data
+
+        yield timestamp, data
+
+
+class RawWriter(Thread):
+
+    """
+    save the raw samples to an sqlite3 db from its own thread
+
+    The logger hands over each batch of samples with add(). A run of samples
+    repeating the previous one is stored as a single NULL row with the number
+    of repeats and the timestamp of the last one, and is only written once
+    the run ends. The rows are written with executemany and committed every
+    `rows` rows or `interval` seconds, in WAL mode so a crash only loses the
+    last uncommitted rows.
+    """
+
+    def __init__(self, rawfile, freq=None, rows=1000, interval=1.0):
+        super().__init__()
+        self.rawfile = rawfile
+        self.freq = freq
+        self.max_rows = rows
+        self.interval = interval
+        self.queue = SimpleQueue()
+        self.last_sample = b''
+        self.run_length = None
+        self.failed = False
+
+        self.rows = 0
+        self.commits = 0
+        self.commit_time = 0.0
+        self.max_commit_time = 0.0
+
+    def add(self, samples):
+        """
+        queue a batch of (timestamp, sample) to be saved, called from the logger
+        """
+        if not self.is_alive():
+            # e.g. the disk filled up, nothing would ever take the rows off
+            # the queue, so the logger goes on without the raw samples
+            if not self.failed:
+                l.error(f"RAW: gravação de {self.rawfile} interrompida, descartando as amostras")
+                self.failed = True
+            return
+
+        rows = []
+        last_sample = self.last_sample
+        for timestamp, sample in samples:
+            if sample == last_sample:
+                rows.append((timestamp, None))
+            else:
+                # the sample may be a view of a buffer the sampler reuses
+                last_sample = bytes(sample)
+                rows.append((timestamp, last_sample))
+        self.last_sample = last_sample
+        self.queue.put(rows)
+
+    def stop(self):
+        """
+        write whatever is left and wait for the thread
+        """
+        self.queue.put(None)
+        self.join()
+
+    def run(self):
+        os.makedirs(os.path.dirname(self.rawfile), exist_ok=True)
+        self.open()
+
+        started = last_commit = time.monotonic()
+        pending = []
+        running = True
+
+        while running:
+            try:
+                rows = self.queue.get(timeout=self.interval)
+                if rows is None:
+                    running = False
+                else:
+                    pending.extend(rows)
+            except Empty:
+                pass
+
+            if not running or (pending and (len(pending) >= self.max_rows
+                                            or time.monotonic() - last_commit >= self.interval)):
+                self.commit(pending, final=not running)
+                pending = []
+                last_commit = time.monotonic()
+
+        self.close()
+
+        elapsed = time.monotonic() - started
+        if self.commits:
+            l.info(f"RAW: {self.rows} pacotes, {self.rows / elapsed:.0f} pacotes/s,"
+                   f" {self.commits} commits, média {self.commit_time / self.commits * 1000:.1f}ms,"
+                   f" máximo {self.max_commit_time * 1000:.1f}ms")
+
+    def collapse(self, rows, final=False):
+        """
+        turn the rows into (timestamp, data, count, last) records, with a
+        record of data None and count repeats for every run that has ended
+        """
+        records = []
+        run = self.run_length
+        for timestamp, data in rows:
+            if data is None:
+                if run:
+                    run[1] = timestamp
+                    run[2] += 1
+                else:
+                    run = [timestamp, timestamp, 1]
+            else:
+                if run:
+                    records.append((run[0], None, run[2], run[1]))
+                    run = None
+                records.append((timestamp, data, 1, timestamp))
+        if run and final:
+            records.append((run[0], None, run[2], run[1]))
+            run = None
+        self.run_length = run
+        return records
+
+    def commit(self, rows, final=False):
+        records = self.collapse(rows, final=final)
+        self.rows += len(rows)
+        if not records:
+            return
+
+        start = time.perf_counter()
+        self.write(records)
+        took = time.perf_counter() - start
+
+        self.commits += 1
+        self.commit_time += took
+        self.max_commit_time = max(self.max_commit_time, took)
+
+    def open(self):
+        self.con = sqlite3.connect(self.rawfile)
+        self.con.execute("PRAGMA journal_mode=WAL")
+        self.con.execute("PRAGMA synchronous=NORMAL")
+        self.con.execute("CREATE TABLE samples(timestamp float, data blob, repeats integer, last float)")
+        self.con.execute("CREATE TABLE settings(name, value)")
+        self.con.execute("INSERT INTO settings(name, value) values (?, ?)",
+                         ("freq", self.freq))
+        self.con.commit()
+
+    def write(self, records):
+        self.con.executemany(
+            "INSERT INTO samples(timestamp, data, repeats, last) VALUES (?, ?, ?, ?)",
+            [record if record[1] is None else (record[0], record[1], None, None) for record in records])
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
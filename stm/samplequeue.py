@@ -0,0 +1,119 @@
+from collections import deque
+from threading import Lock, Condition
+from queue import Empty, Full
+from time import monotonic
+
+# what to do with a new sample when the queue is full
+DROP_OLDEST = "drop-oldest"
+DROP_NEWEST = "drop-newest"
+BLOCK = "block"
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+NOTHING = object()
+
+
+class SampleQueue:
+
+    """
+    FIFO between a sampler and a logger with an optional maximum depth
+
+    When full, a put either drops the oldest queued sample, drops the new
+    sample or blocks until there is room. Dropped samples are passed to
+    on_drop so their owner can recycle them. The consumer is only notified
+    when it is actually waiting, and can take everything queued in one go
+    with get_many.
+    """
+
+    def __init__(self, maxsize=0, policy=DROP_OLDEST, on_drop=None):
+        if policy not in POLICIES:
+            raise ValueError(f"unknown queue policy {policy}, expected one of {POLICIES}")
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.on_drop = on_drop
+
+        self.queue = deque()
+        self.mutex = Lock()
+        self.not_empty = Condition(self.mutex)
+        self.not_full = Condition(self.mutex)
+        self.getters = 0
+        self.putters = 0
+
+        self.dropped = 0
+        self.high_water = 0
+
+    def qsize(self):
+        return len(self.queue)
+
+    def put(self, item, timeout=None):
+        dropped = NOTHING
+        with self.mutex:
+            if self.maxsize > 0 and len(self.queue) >= self.maxsize:
+                if self.policy == DROP_OLDEST:
+                    dropped = self.queue.popleft()
+                elif self.policy == DROP_NEWEST:
+                    dropped = item
+                else:
+                    self._wait(self.not_full, lambda: len(self.queue) < self.maxsize,
+                               timeout, Full, "putters")
+
+            if dropped is NOTHING or self.policy == DROP_OLDEST:
+                self.queue.append(item)
+                size = len(self.queue)
+                if size > self.high_water:
+                    self.high_water = size
+                if self.getters:
+                    self.not_empty.notify()
+
+            if dropped is not NOTHING:
+                self.dropped += 1
+
+        if dropped is not NOTHING and self.on_drop:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        with self.mutex:
+            if not self.queue:
+                self._wait(self.not_empty, lambda: self.queue, timeout, Empty, "getters")
+            item = self.queue.popleft()
+            if self.putters:
+                self.not_full.notify()
+            return item
+
+    def get_many(self, maxitems=None, timeout=None):
+        """
+        wait for at least one sample and return a list of all the queued
+        samples, up to maxitems
+        """
+        with self.mutex:
+            if not self.queue:
+                self._wait(self.not_empty, lambda: self.queue, timeout, Empty, "getters")
+
+            queue = self.queue
+            if maxitems is None or maxitems >= len(queue):
+                items = list(queue)
+                queue.clear()
+            else:
+                items = [queue.popleft() for _ in range(maxitems)]
+
+            if self.putters:
+                self.not_full.notify_all()
+            return items
+
+    def _wait(self, condition, predicate, timeout, exception, counter):
+        # called with the mutex held
+        setattr(self, counter, getattr(self, counter) + 1)
+        try:
+            if timeout is None:
+                while not predicate():
+                    condition.wait()
+            else:
+                end = monotonic() + timeout
+                while not predicate():
+                    remaining = end - monotonic()
+                    if remaining <= 0.0:
+                        raise exception
+                    condition.wait(remaining)
+        finally:
+            setattr(self, counter, getattr(self, counter) - 1)
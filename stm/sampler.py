@@ -1,22 +1,42 @@
 from threading import Thread
-from queue import Queue
+from queue import Queue, Full
+from collections import deque
+from itertools import islice
+from .samplequeue import SampleQueue, DROP_OLDEST
+from .rawfile import RawFile, ChunkedRawFile, is_rawfile, is_chunked
+from .rawwriter import read_samples
 import sqlite3
+import time
 from logging import getLogger
 l = getLogger(__name__)
 
+# samples per batch when replaying at full speed
+RAW_BATCH = 1000
+
 class BaseSampler(Thread):
 
-    def __init__(self, freq=None):
+    def __init__(self, freq=None, maxsize=0, policy=DROP_OLDEST):
         super().__init__()
         self.freq = freq
-        self.samples = Queue()
+        self.samples = SampleQueue(maxsize=maxsize, policy=policy)
         self.running = False
 
+    @property
+    def dropped(self):
+        return self.samples.dropped
+
+    @property
+    def high_water(self):
+        return self.samples.high_water
+
     def get(self, timeout=None):
         return self.samples.get(timeout=timeout)
 
+    def get_many(self, maxitems=None, timeout=None):
+        return self.samples.get_many(maxitems=maxitems, timeout=timeout)
+
     def put(self, sample):
-        self.samples.put(sample, block=False)
+        self.samples.put(sample)
 
     def stop(self):
         l.warning("Finalizando o sampler")
@@ -24,45 +44,112 @@ class BaseSampler(Thread):
 
 class RawSampler(Thread):
 
-    def __init__(self, rawfile=None):
+    """
+    replay a raw capture
+
+    With speed None or "max" the samples are handed over in batches as fast
+    as the logger takes them, with a number they are paced by their
+    timestamps, 1.0 being real time and 2.0 twice as fast.
+    """
+
+    def __init__(self, rawfile=None, speed=None):
         super().__init__()
-        self.samples = Queue(maxsize=1)
+        self.samples = Queue(maxsize=2)
+        self.batch = deque()
         self.running = False
         self.rawfile = rawfile
         self.freq = None # get the freq from the sample file
+        # the compressed captures hold the packets already decrypted
+        self.encrypted = not is_chunked(rawfile)
+        self.speed = None if speed in (None, "max") else float(speed)
 
     def run(self):
         self.running = True
-        con = sqlite3.connect(self.rawfile, isolation_level=None)
-        cur = con.cursor()
-        res = cur.execute("SELECT value FROM settings WHERE name='freq'")
-        (self.freq, ) = res.fetchone()
-        res = cur.execute("SELECT * FROM samples ORDER BY timestamp")
+        if is_chunked(self.rawfile):
+            res = self.read_rawfile(ChunkedRawFile)
+        elif is_rawfile(self.rawfile):
+            res = self.read_rawfile(RawFile)
+        else:
+            res = self.read_db()
 
-        last_data = None
+        try:
+            if self.speed:
+                self.replay_paced(res)
+            else:
+                self.replay_batches(res)
+        except Exception as e:
+            l.error(f"Erro lendo {self.rawfile}: {e}")
+        finally:
+            res.close()
+            self.running = False
 
+    def replay_batches(self, res):
         while self.running:
+            batch = list(islice(res, RAW_BATCH))
+            if not batch:
+                break
+            self.put(batch)
+
+    def replay_paced(self, res):
+        started = None
+        for timestamp, data in res:
+            if not self.running:
+                break
+            if started is None:
+                started = (time.monotonic(), timestamp)
 
+            delay = started[0] + (timestamp - started[1]) / self.speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.put([(timestamp, data)])
+
+    def put(self, batch):
+        while self.running:
             try:
-                timestamp, data = next(res)
-                if isinstance(timestamp, int):
-                    timestamp = timestamp / 1000.0
+                self.samples.put(batch, timeout=1)
+                return
+            except Full:
+                pass
 
-                if data is None:
-                    # repeat the last changed sample
-                    data = last_data
-                else:
-                    last_data = data
+    def read_db(self):
+        con = sqlite3.connect(self.rawfile, isolation_level=None)
+        try:
+            cur = con.cursor()
+            res = cur.execute("SELECT value FROM settings WHERE name='freq'")
+            (self.freq, ) = res.fetchone()
+            yield from read_samples(con)
+        finally:
+            con.close()
 
-                self.samples.put( (timestamp, data), block=True )
-            except:
-                self.running = False
+    def read_rawfile(self, reader):
+        raw = reader(self.rawfile)
+        try:
+            self.freq = raw.freq
+            yield from raw
+        finally:
+            raw.close()
 
-        con.close()
+    def is_alive(self):
+        # still alive until the logger has taken the last samples
+        return super().is_alive() or bool(self.batch) or not self.samples.empty()
 
     def get(self, timeout=None):
-        return self.samples.get(timeout=timeout)
-    
+        if not self.batch:
+            self.batch.extend(self.samples.get(timeout=timeout))
+        return self.batch.popleft()
+
+    def get_many(self, maxitems=None, timeout=None):
+        batch = self.batch
+        if not batch:
+            batch.extend(self.samples.get(timeout=timeout))
+
+        if maxitems is None or maxitems >= len(batch):
+            items = list(batch)
+            batch.clear()
+        else:
+            items = [batch.popleft() for _ in range(maxitems)]
+        return items
+
     def stop(self):
         l.warning("Finalizando o sampler")
         self.running = False